@@ -0,0 +1,86 @@
+import contextlib
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+
+
+def _aws_environ():
+    # Credentials, region, endpoint and tool settings all live in aws_* variables
+    return {name: value for name, value in os.environ.items() if name.lower().startswith('aws_')}
+
+
+def _replace_aws_environ(env):
+    for name in _aws_environ():
+        if name not in env:
+            del os.environ[name]
+    os.environ.update(env)
+
+
+def forward_command(socket_path, argv):
+    """
+    Run a command line on a daemon started with serve-cmd
+    The command sees this process's aws_* environment and its stdout and
+    stderr are written to ours. Returns its exit code, or None if no daemon
+    is listening
+    """
+    try:
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(socket_path)
+    except OSError:
+        return None
+
+    with conn, conn.makefile('rwb') as stream:
+        request = {'argv': argv, 'cwd': os.getcwd(), 'env': _aws_environ()}
+        stream.write(json.dumps(request).encode() + b'\n')
+        stream.flush()
+        line = stream.readline()
+    if not line:
+        return None
+    result = json.loads(line)
+    print(result['stdout'], end='')
+    print(result['stderr'], end='', file=sys.stderr)
+    return result['exit_code']
+
+
+def serve(socket_path, run):
+    """
+    Serve command lines on a Unix socket, one at a time, with run(argv)
+    Each request is a JSON line {"argv": [...], "cwd": "...", "env": {...}}
+    and gets back {"stdout": "...", "stderr": "...", "exit_code": N}. The
+    aws_* variables in env replace the daemon's own while the command runs
+    """
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                request = json.loads(line)
+                stdout, stderr = io.StringIO(), io.StringIO()
+                previous_cwd = os.getcwd()
+                previous_env = _aws_environ()
+                try:
+                    os.chdir(request.get('cwd') or previous_cwd)
+                    if 'env' in request:
+                        _replace_aws_environ(request['env'])
+                    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                        exit_code = run(request['argv'])
+                except Exception as e:
+                    stderr.write(f"{e}\n")
+                    exit_code = 1
+                finally:
+                    os.chdir(previous_cwd)
+                    _replace_aws_environ(previous_env)
+                response = {'stdout': stdout.getvalue(), 'stderr': stderr.getvalue(), 'exit_code': exit_code}
+                self.wfile.write(json.dumps(response).encode() + b'\n')
+                self.wfile.flush()
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    with socketserver.UnixStreamServer(socket_path, Handler) as server:
+        os.chmod(socket_path, 0o600)
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(socket_path)
@@ -1,40 +1,408 @@
 import tempfile
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
 
 from collections import defaultdict
 
-import boto3
 from os import getenv
 
-import magic
-import requests
 import typer
-from dotenv import load_dotenv
 from botocore.exceptions import ClientError
 import json
 
+import atexit
+import functools
+import hashlib
 import mimetypes
 import math
 import os
-from concurrent.futures import ThreadPoolExecutor
-from threading import Lock
+import random
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from queue import Full, Queue
+from threading import BoundedSemaphore, Condition, Event, Lock, local
+import time
+import zlib
+
+MB = 1024 * 1024
+MIN_PART_SIZE = 5 * MB
+MAX_PART_SIZE = 5 * 1024 * MB
+MAX_PARTS = 10000
+DEFAULT_PART_SIZE = 10 * MB
+MULTIPART_THRESHOLD = 100 * MB
+DEFAULT_CONCURRENCY = 4
+MAX_CONCURRENCY = 16
+MULTIPART_COPY_THRESHOLD = 1024 * MB
+SYNC_WORKERS = 8
+HEDGE_WORKERS = 4
+HEDGE_MIN_SAMPLES = 8
+PART_CHECKSUM_FIELDS = ('ChecksumCRC32', 'ChecksumCRC32C', 'ChecksumSHA1', 'ChecksumSHA256')
+
+
+_clients = {}
+_clients_lock = Lock()
+
+
+@functools.cache
+def load_env():
+    """
+    Load .env once, on first use instead of at import time
+    """
+    from dotenv import load_dotenv
 
-load_dotenv()
+    load_dotenv()
 
 
-def init_client():
-    try:
-        client = boto3.client(
-            "s3",
-            aws_access_key_id=getenv("aws_access_key_id"),
-            aws_secret_access_key=getenv("aws_secret_access_key"),
-            aws_session_token=getenv("aws_session_token"),
-            region_name=getenv("aws_region_name"))
+def init_client(max_pool_connections=None, region_name=None):
+    """
+    Shared S3 client, cached per region and credentials
 
+    max_pool_connections should match the number of threads that will use
+    the client; asking for more than the cached client has replaces it with
+    a bigger one. aws_max_pool_connections, aws_connect_timeout,
+    aws_read_timeout and aws_tcp_keepalive in the environment tune it, and
+    aws_endpoint_url points it at an S3-compatible server
+    """
+    import boto3
+    from botocore.config import Config
+
+    load_env()
+    region_name = region_name or getenv("aws_region_name")
+    credentials = (getenv("aws_access_key_id"), getenv("aws_secret_access_key"), getenv("aws_session_token"))
+    pool_size = max(max_pool_connections or 0, int(getenv("aws_max_pool_connections") or 10))
+    endpoint_url = getenv("aws_endpoint_url") or None
+    cache_key = (region_name, credentials, endpoint_url)
+
+    with _clients_lock:
+        cached = _clients.get(cache_key)
+        if cached and cached[0] >= pool_size:
+            return cached[1]
+        try:
+            client = boto3.client(
+                "s3",
+                aws_access_key_id=credentials[0],
+                aws_secret_access_key=credentials[1],
+                aws_session_token=credentials[2],
+                region_name=region_name,
+                endpoint_url=endpoint_url,
+                config=Config(
+                    max_pool_connections=pool_size,
+                    connect_timeout=float(getenv("aws_connect_timeout") or 60),
+                    read_timeout=float(getenv("aws_read_timeout") or 60),
+                    tcp_keepalive=(getenv("aws_tcp_keepalive") or "true").lower() in ("1", "true", "yes")
+                ))
+        except ClientError as e:
+            print(e)
+            raise e
+        if _metrics is not None:
+            _attach_metrics(client)
+        if _limiter is not None:
+            _attach_limiter(client)
+        _clients[cache_key] = (pool_size, client)
         return client
-    except ClientError as e:
-        print(e)
-        raise e
+
+
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, float('inf'))
+THROTTLE_CODES = ('SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequests')
+
+
+class RequestMetrics:
+    """
+    Per-operation request statistics collected from botocore event hooks
+
+    Every HTTP attempt is timed from before-send to response-received and
+    put in a latency histogram; retries, throttling responses (503 SlowDown)
+    and bytes sent/received are counted per operation. The average number of
+    requests in flight against the thread count tells whether a run was held
+    back by S3/the network or by its own worker pool
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.operations = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = Lock()
+        self._local = local()
+
+    def _operation(self, event_name):
+        name = event_name.rsplit('.', 1)[-1]
+        if name not in self.operations:
+            self.operations[name] = {
+                'calls': 0, 'attempts': 0, 'errors': 0, 'throttled': 0,
+                'bytes_sent': 0, 'bytes_received': 0, 'latency_ms_total': 0.0, 'latency_ms_max': 0.0,
+                'histogram': [0] * len(LATENCY_BUCKETS_MS)
+            }
+        return self.operations[name]
+
+    def _before_call(self, event_name, **kwargs):
+        with self._lock:
+            self._operation(event_name)['calls'] += 1
+
+    def _before_send(self, event_name, request, **kwargs):
+        self._local.started = time.monotonic()
+        with self._lock:
+            stats = self._operation(event_name)
+            stats['attempts'] += 1
+            # Streaming uploads are aws-chunked and carry the real size separately
+            stats['bytes_sent'] += int(request.headers.get('X-Amz-Decoded-Content-Length')
+                                       or request.headers.get('Content-Length') or 0)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def _response_received(self, event_name, response_dict=None, parsed_response=None, exception=None, **kwargs):
+        started = getattr(self._local, 'started', None)
+        latency_ms = (time.monotonic() - started) * 1000 if started is not None else 0.0
+        status = response_dict['status_code'] if response_dict else None
+        code = (parsed_response or {}).get('Error', {}).get('Code')
+        with self._lock:
+            stats = self._operation(event_name)
+            self.in_flight = max(self.in_flight - 1, 0)
+            stats['latency_ms_total'] += latency_ms
+            stats['latency_ms_max'] = max(stats['latency_ms_max'], latency_ms)
+            stats['histogram'][next(i for i, bound in enumerate(LATENCY_BUCKETS_MS) if latency_ms <= bound)] += 1
+            if response_dict:
+                stats['bytes_received'] += int(response_dict['headers'].get('content-length') or 0)
+            if exception is not None or (status and status >= 400):
+                stats['errors'] += 1
+            if code in THROTTLE_CODES or status in (429, 503):
+                stats['throttled'] += 1
+
+    @staticmethod
+    def _percentile(stats, fraction):
+        # Upper bound of the bucket holding the percentile, capped at the max seen
+        histogram = stats['histogram']
+        total = sum(histogram)
+        if not total:
+            return 0
+        seen = 0
+        for count, bound in zip(histogram, LATENCY_BUCKETS_MS):
+            seen += count
+            if seen >= fraction * total:
+                return round(min(bound, stats['latency_ms_max']), 1)
+        return round(stats['latency_ms_max'], 1)
+
+    def snapshot(self):
+        with self._lock:
+            elapsed = max(time.monotonic() - self.started, 1e-6)
+            operations = {}
+            for name, stats in self.operations.items():
+                attempts = stats['attempts'] or 1
+                operations[name] = dict(
+                    stats,
+                    retries=max(stats['attempts'] - stats['calls'], 0),
+                    latency_ms_avg=round(stats['latency_ms_total'] / attempts, 2),
+                    latency_ms_p50=self._percentile(stats, 0.5),
+                    latency_ms_p95=self._percentile(stats, 0.95),
+                    latency_ms_p99=self._percentile(stats, 0.99),
+                    histogram_bounds_ms=[str(bound) for bound in LATENCY_BUCKETS_MS]
+                )
+            busy_ms = sum(stats['latency_ms_total'] for stats in self.operations.values())
+            return {
+                'elapsed_s': round(elapsed, 3),
+                'avg_in_flight': round(busy_ms / 1000 / elapsed, 2),
+                'max_in_flight': self.max_in_flight,
+                'operations': operations
+            }
+
+    def summary_table(self):
+        snapshot = self.snapshot()
+        lines = [f"{'operation':<24}{'calls':>7}{'retries':>8}{'throttled':>10}{'errors':>7}"
+                 f"{'p50 ms':>8}{'p95 ms':>8}{'max ms':>9}{'MB sent':>9}{'MB recv':>9}"]
+        for name, stats in sorted(snapshot['operations'].items()):
+            lines.append(f"{name:<24}{stats['calls']:>7}{stats['retries']:>8}{stats['throttled']:>10}"
+                         f"{stats['errors']:>7}{stats['latency_ms_p50']:>8}{stats['latency_ms_p95']:>8}"
+                         f"{stats['latency_ms_max']:>9.0f}{stats['bytes_sent'] / MB:>9.1f}"
+                         f"{stats['bytes_received'] / MB:>9.1f}")
+        lines.append(f"elapsed {snapshot['elapsed_s']}s, requests in flight: "
+                     f"avg {snapshot['avg_in_flight']}, max {snapshot['max_in_flight']}")
+        return "\n".join(lines)
+
+
+_metrics = None
+
+
+def _metrics_before_call(**kwargs):
+    metrics = _metrics
+    if metrics is not None:
+        metrics._before_call(**kwargs)
+
+
+def _metrics_before_send(**kwargs):
+    metrics = _metrics
+    if metrics is not None:
+        metrics._before_send(**kwargs)
+
+
+def _metrics_response_received(**kwargs):
+    metrics = _metrics
+    if metrics is not None:
+        metrics._response_received(**kwargs)
+
+
+def _attach_metrics(client):
+    # Cached clients outlive a daemon invocation; the unique ids keep one
+    # handler per client that reports to whichever collector is current
+    client.meta.events.register('before-call.s3', _metrics_before_call, unique_id='s3-cli-metrics-call')
+    client.meta.events.register('before-send.s3', _metrics_before_send, unique_id='s3-cli-metrics-send')
+    client.meta.events.register('response-received.s3', _metrics_response_received,
+                                unique_id='s3-cli-metrics-response')
+
+
+def enable_metrics():
+    """
+    Start collecting RequestMetrics on every client from init_client,
+    replacing the collector of an earlier call
+    """
+    global _metrics
+    with _clients_lock:
+        _metrics = RequestMetrics()
+        for _, client in _clients.values():
+            _attach_metrics(client)
+    return _metrics
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled at rate tokens per second
+
+    acquire() takes its tokens right away, possibly into debt, and sleeps
+    until the debt is paid off, so callers queue up in order and the long
+    run rate stays at rate even for requests bigger than the burst
+    """
+
+    def __init__(self, rate, burst_seconds=0.25):
+        self.rate = float(rate)
+        self.burst = max(self.rate * burst_seconds, 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = float(rate)
+
+    def acquire(self, amount=1):
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """
+    Process-wide bytes/s and requests/s ceilings for S3 traffic
+
+    Every HTTP attempt of every client from init_client takes a request
+    token and its body size in bandwidth tokens before it is sent, and
+    response bodies are charged when their headers arrive, so multipart
+    parts, small uploads, copies, deletes and downloads share one budget.
+    A throttling response (503 SlowDown) halves the request rate, at most
+    once per second, and the rate then climbs back linearly to max_rps over
+    recovery_s seconds, so it settles under the limit S3 enforces instead
+    of oscillating around it
+    """
+
+    def __init__(self, max_bandwidth=None, max_rps=None, recovery_s=10.0, min_rps=1.0):
+        self.max_rps = max_rps
+        self.bandwidth = TokenBucket(max_bandwidth) if max_bandwidth else None
+        self.requests = TokenBucket(max_rps) if max_rps else None
+        self.recovery_s = recovery_s
+        self.min_rps = min_rps
+        self.throttled = 0
+        self._backed_off_at = None
+        self._backed_off_rate = None
+        self._lock = Lock()
+
+    def _recover(self):
+        with self._lock:
+            if self._backed_off_at is None:
+                return
+            elapsed = time.monotonic() - self._backed_off_at
+            rate = self._backed_off_rate + self.max_rps * elapsed / self.recovery_s
+            if rate >= self.max_rps:
+                rate = self.max_rps
+                self._backed_off_at = None
+        self.requests.set_rate(rate)
+
+    def _back_off(self):
+        now = time.monotonic()
+        with self._lock:
+            self.throttled += 1
+            if self.requests is None:
+                return
+            if self._backed_off_at is not None and now - self._backed_off_at < 1.0:
+                return
+            self._backed_off_rate = max(self.requests.rate / 2, self.min_rps)
+            self._backed_off_at = now
+        self.requests.set_rate(self._backed_off_rate)
+
+    def before_send(self, request, **kwargs):
+        if self.requests is not None:
+            self._recover()
+            self.requests.acquire()
+        if self.bandwidth is not None:
+            nbytes = int(request.headers.get('X-Amz-Decoded-Content-Length')
+                         or request.headers.get('Content-Length') or 0)
+            if nbytes:
+                self.bandwidth.acquire(nbytes)
+
+    def response_received(self, response_dict=None, parsed_response=None, **kwargs):
+        if not response_dict:
+            return
+        status = response_dict['status_code']
+        code = (parsed_response or {}).get('Error', {}).get('Code')
+        if code in THROTTLE_CODES or status in (429, 503):
+            self._back_off()
+        if self.bandwidth is not None and status < 300:
+            nbytes = int(response_dict['headers'].get('content-length') or 0)
+            if nbytes:
+                self.bandwidth.acquire(nbytes)
+
+
+_limiter = None
+
+
+def _limit_before_send(**kwargs):
+    limiter = _limiter
+    if limiter is not None:
+        limiter.before_send(**kwargs)
+
+
+def _limit_response_received(**kwargs):
+    limiter = _limiter
+    if limiter is not None:
+        limiter.response_received(**kwargs)
+
+
+def _attach_limiter(client):
+    # First in line, so metrics time the request and not the wait for tokens
+    client.meta.events.register_first('before-send.s3', _limit_before_send, unique_id='s3-cli-limit-send')
+    client.meta.events.register_first('response-received.s3', _limit_response_received,
+                                      unique_id='s3-cli-limit-response')
+
+
+def set_rate_limit(max_bandwidth=None, max_rps=None):
+    """
+    Cap S3 traffic of every client from init_client at max_bandwidth bytes/s
+    and max_rps requests/s, None for both removes the limits
+    """
+    global _limiter
+    with _clients_lock:
+        if not max_bandwidth and not max_rps:
+            _limiter = None
+            return None
+        _limiter = RateLimiter(max_bandwidth, max_rps)
+        for _, client in _clients.values():
+            _attach_limiter(client)
+    return _limiter
 
 
 def list_buckets(aws_s3_client):
@@ -86,31 +454,241 @@ def bucket_exists(aws_s3_client, bucket_name):
     return False
 
 
+def _read_exactly(stream, size):
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = stream.read(size - len(buffer))
+        if not chunk:
+            break
+        buffer += chunk
+    return bytes(buffer)
+
+
+def upload_stream(aws_s3_client, bucket_name, key, stream, content_type=None, part_size=DEFAULT_PART_SIZE,
+                  max_workers=DEFAULT_CONCURRENCY, tee=None, executor=None, content_encoding=None,
+                  cache_control=None):
+    """
+    Upload a non-seekable stream (e.g. an HTTP body) as it is read
+
+    Parts upload on a thread pool while the next part is being read, so at
+    most max_workers + 1 parts are held in memory. A stream shorter than one
+    part is sent with a single put_object. tee, if given, is a file that
+    receives a copy of every byte; executor lets callers share one pool
+    """
+    object_args = {'ContentType': content_type or 'application/octet-stream'}
+    if content_encoding:
+        object_args['ContentEncoding'] = content_encoding
+    if cache_control:
+        object_args['CacheControl'] = cache_control
+    part_size = max(part_size, MIN_PART_SIZE)
+
+    data = _read_exactly(stream, part_size)
+    if tee is not None:
+        tee.write(data)
+    if len(data) < part_size:
+        try:
+            aws_s3_client.put_object(Bucket=bucket_name, Key=key, Body=data, **object_args)
+            return True
+        except ClientError as e:
+            print(f"Error uploading stream: {e}")
+            return False
+
+    upload_id = None
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+    slots = BoundedSemaphore(max_workers)
+    futures = []
+    errors = []
+
+    def upload_part(part_number, body):
+        try:
+            response = aws_s3_client.upload_part(
+                Bucket=bucket_name,
+                Key=key,
+                PartNumber=part_number,
+                UploadId=upload_id,
+                Body=body
+            )
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+        except Exception as e:
+            errors.append(e)
+            raise
+        finally:
+            slots.release()
+
+    try:
+        mpu = aws_s3_client.create_multipart_upload(Bucket=bucket_name, Key=key, **object_args)
+        upload_id = mpu['UploadId']
+        part_number = 1
+        while data:
+            if part_number > MAX_PARTS:
+                raise ValueError(f"Stream needs more than {MAX_PARTS} parts of {part_size} bytes")
+            slots.acquire()
+            # Stop reading at the first failed part instead of draining the whole stream
+            if errors:
+                slots.release()
+                raise errors[0]
+            futures.append(executor.submit(upload_part, part_number, data))
+            data = _read_exactly(stream, part_size)
+            if tee is not None:
+                tee.write(data)
+            part_number += 1
+
+        parts = [future.result() for future in futures]
+        aws_s3_client.complete_multipart_upload(
+            Bucket=bucket_name,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': parts}
+        )
+        return True
+    except Exception as e:
+        print(f"Error uploading stream: {e}")
+        for future in futures:
+            future.cancel()
+        # Parts still in flight would race the abort
+        wait(futures)
+        if upload_id is not None:
+            aws_s3_client.abort_multipart_upload(Bucket=bucket_name, Key=key, UploadId=upload_id)
+        return False
+    finally:
+        if own_executor:
+            executor.shutdown(wait=True)
+
+
 def download_file_and_upload_to_s3(aws_s3_client,
                                    bucket_name,
                                    url,
                                    file_name,
                                    keep_local=False):
     from urllib.request import urlopen
-    import io
     with urlopen(url) as response:
-        content = response.read()
+        content_type = (response.headers.get('Content-Type')
+                        or mimetypes.guess_type(file_name)[0]
+                        or 'application/octet-stream')
+        local_file = open(file_name, mode='wb') if keep_local else None
         try:
-            aws_s3_client.upload_fileobj(
-                Fileobj=io.BytesIO(content),
-                Bucket=bucket_name,
-                ExtraArgs={'ContentType': 'image/jpg'},
-                Key=file_name)
+            upload_stream(aws_s3_client, bucket_name, file_name, response,
+                          content_type=content_type, tee=local_file)
         except Exception as e:
             print(e)
-
-    if keep_local:
-        with open(file_name, mode='wb') as file:
-            file.write(content)
+        finally:
+            if local_file is not None:
+                local_file.close()
 
     return f"https://s3-us-west-2.amazonaws.com/{bucket_name}/{file_name}"
 
 
+def read_url_manifest(manifest_path):
+    """
+    Read "URL [KEY]" lines, the key defaults to the last path segment
+    Blank lines and lines starting with # are skipped
+    """
+    with open(manifest_path) as manifest:
+        for line in manifest:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split(None, 1)
+            url = fields[0]
+            key = fields[1].strip() if len(fields) > 1 else os.path.basename(urlparse(url).path)
+            yield url, key
+
+
+class _ByteCounter:
+    def __init__(self):
+        self.bytes = 0
+
+    def write(self, data):
+        self.bytes += len(data)
+
+
+def ingest_urls(aws_s3_client, bucket_name, entries, report_path, max_workers=16, per_host=4,
+                upload_workers=16, part_size=DEFAULT_PART_SIZE, timeout=60):
+    """
+    Fetch (url, key) entries concurrently and stream each body into S3
+
+    At most per_host requests run against one host, each fetch thread keeps
+    a pooled requests session, and all bodies share one upload pool.
+    Every result is appended to the NDJSON report; keys already reported as
+    ok are skipped, so a re-run only fetches what is missing or failed
+    """
+    import requests
+
+    done_keys = set()
+    if os.path.exists(report_path):
+        with open(report_path) as report:
+            for line in report:
+                if line.strip():
+                    result = json.loads(line)
+                    if result.get('status') == 'ok':
+                        done_keys.add(result['key'])
+
+    summary = {'ok': 0, 'failed': 0, 'skipped': 0}
+    host_limits = {}
+    lock = Lock()
+    sessions = local()
+    slots = BoundedSemaphore(2 * max_workers)
+
+    def host_limit(url):
+        host = urlparse(url).netloc
+        with lock:
+            if host not in host_limits:
+                host_limits[host] = BoundedSemaphore(per_host)
+            return host_limits[host]
+
+    def session():
+        if not hasattr(sessions, 'session'):
+            sessions.session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=per_host, pool_maxsize=per_host)
+            sessions.session.mount('http://', adapter)
+            sessions.session.mount('https://', adapter)
+        return sessions.session
+
+    def ingest(url, key):
+        started = time.monotonic()
+        counter = _ByteCounter()
+        result = {'url': url, 'key': key}
+        try:
+            with host_limit(url):
+                with session().get(url, stream=True, timeout=timeout) as response:
+                    result['http_status'] = response.status_code
+                    response.raise_for_status()
+                    response.raw.decode_content = True
+                    content_type = (response.headers.get('Content-Type')
+                                    or mimetypes.guess_type(key)[0])
+                    ok = upload_stream(aws_s3_client, bucket_name, key, response.raw, content_type,
+                                       part_size=part_size, tee=counter, executor=upload_pool)
+            result['status'] = 'ok' if ok else 'error'
+            if not ok:
+                result['error'] = 'upload failed'
+        except Exception as e:
+            result['status'] = 'error'
+            result['error'] = str(e)
+        finally:
+            slots.release()
+        result['bytes'] = counter.bytes
+        result['latency'] = round(time.monotonic() - started, 3)
+        with lock:
+            summary['ok' if result['status'] == 'ok' else 'failed'] += 1
+            report.write(json.dumps(result) + '\n')
+            report.flush()
+
+    with open(report_path, 'a') as report, \
+            ThreadPoolExecutor(max_workers=upload_workers) as upload_pool, \
+            ThreadPoolExecutor(max_workers=max_workers) as fetch_pool:
+        for url, key in entries:
+            if key in done_keys:
+                summary['skipped'] += 1
+                continue
+            slots.acquire()
+            fetch_pool.submit(ingest, url, key)
+        fetch_pool.shutdown(wait=True)
+
+    return summary
+
+
 def set_object_access_policy(aws_s3_client, bucket_name, file_name):
     try:
         response = aws_s3_client.put_object_acl(ACL="public-read",
@@ -158,15 +736,184 @@ def read_bucket_policy(aws_s3_client, bucket_name):
         return False
 
 
-def upload_small_file(aws_s3_client, bucket_name, file_path, key=None):
+class ContentTypeDetector:
+    """
+    Classifies files for Content-Type, at most once per file
+
+    sniff="never" uses the extension only, "fallback" sniffs with libmagic
+    when the extension is unknown and "always" sniffs every file. libmagic
+    handles are kept per thread and sniffed results are cached by
+    (device, inode, size, mtime) in a JSON file that is saved at exit
+    """
+
+    max_entries = 100000
+
+    def __init__(self, cache_path=None):
+        self.cache_path = cache_path or os.path.join(cache_dir(), "content-types.json")
+        self._cache = load_json_state(self.cache_path) or {}
+        self._dirty = False
+        self._lock = Lock()
+        self._local = local()
+        atexit.register(self.save)
+
+    def _magic(self):
+        if not hasattr(self._local, 'magic'):
+            import magic
+
+            self._local.magic = magic.Magic(mime=True)
+        return self._local.magic
+
+    def guess(self, file_path, sniff="never"):
+        if sniff != "always":
+            content_type = mimetypes.guess_type(file_path)[0]
+            if content_type or sniff == "never":
+                return content_type
+
+        file_stat = os.stat(file_path)
+        cache_key = f"{file_stat.st_dev}:{file_stat.st_ino}:{file_stat.st_size}:{file_stat.st_mtime_ns}"
+        content_type = self._cache.get(cache_key)
+        if content_type is None:
+            content_type = self._magic().from_file(file_path)
+            with self._lock:
+                if len(self._cache) >= self.max_entries:
+                    del self._cache[next(iter(self._cache))]
+                self._cache[cache_key] = content_type
+                self._dirty = True
+        return content_type
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            save_json_state(self.cache_path, self._cache)
+            self._dirty = False
+
+
+@functools.cache
+def content_type_detector():
+    """
+    Shared ContentTypeDetector for this process
+    """
+    return ContentTypeDetector()
+
+
+def guess_content_type(file_path, sniff="never"):
+    """
+    Content-Type of a file through the shared detector, None if unknown
+    """
+    return content_type_detector().guess(file_path, sniff)
+
+
+COMPRESSIBLE_TYPES = {
+    'application/json', 'application/javascript', 'application/xml', 'application/xhtml+xml',
+    'application/x-javascript', 'application/ld+json', 'application/manifest+json', 'application/wasm',
+    'application/x-ndjson', 'application/x-sh', 'application/sql', 'application/rtf',
+    'image/svg+xml', 'image/x-icon', 'image/bmp', 'font/ttf', 'font/otf',
+}
+
+
+def is_compressible(content_type):
+    """
+    Whether gzip is worth trying for a Content-Type (text and text-like formats)
+    """
+    if not content_type:
+        return False
+    content_type = content_type.split(';')[0].strip().lower()
+    return content_type.startswith('text/') or content_type in COMPRESSIBLE_TYPES
+
+
+def compression_ratio(file_path, sample_size=256 * 1024):
+    """
+    Estimated gzip size / original size, from samples at the start, middle
+    and end of the file
+    """
+    file_size = os.path.getsize(file_path)
+    if file_size == 0:
+        return 1.0
+    offsets = {0}
+    if file_size > sample_size:
+        offsets |= {file_size // 2 - sample_size // 2, file_size - sample_size}
+    original = compressed = 0
+    with open(file_path, 'rb') as f:
+        for offset in sorted(offsets):
+            f.seek(offset)
+            sample = f.read(sample_size)
+            original += len(sample)
+            compressed += len(zlib.compress(sample, 6))
+    return compressed / original
+
+
+class GzipReader:
+    """
+    File-like object that yields the gzip encoding of a file as it is read
+
+    The file is compressed in chunks (zlib releases the GIL), so only about
+    one chunk of input and the requested output are held at a time. The
+    gzip header carries no name or mtime, so identical files compress to
+    identical bytes
+    """
+
+    def __init__(self, file_path, level=6, chunk_size=MB):
+        self._file = open(file_path, 'rb')
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+        self._eof = False
+
+    def read(self, size=-1):
+        while not self._eof and (size is None or size < 0 or len(self._buffer) < size):
+            chunk = self._file.read(self._chunk_size)
+            if chunk:
+                self._buffer += self._compressor.compress(chunk)
+            else:
+                self._buffer += self._compressor.flush()
+                self._eof = True
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def upload_compressed(aws_s3_client, bucket_name, file_path, key, content_type, max_ratio=0.9,
+                      part_size=DEFAULT_PART_SIZE, max_workers=DEFAULT_CONCURRENCY):
+    """
+    Upload a file gzip-compressed with Content-Encoding: gzip
+    Returns None without uploading when the Content-Type is not compressible
+    or the sampled ratio is above max_ratio, so callers fall back to a plain
+    upload
+    """
+    if not is_compressible(content_type) or compression_ratio(file_path) > max_ratio:
+        return None
+    with GzipReader(file_path) as stream:
+        return upload_stream(aws_s3_client, bucket_name, key, stream, content_type,
+                             part_size=part_size, max_workers=max_workers, content_encoding='gzip')
+
+
+def upload_small_file(aws_s3_client, bucket_name, file_path, key=None, content_type=None, compress=False):
     """
     Upload a small file (< 100MB) to S3
+    content_type skips detection when the caller already classified the file
+    compress=True gzips compressible types (see upload_compressed)
     """
     if key is None:
         key = os.path.basename(file_path)
 
     # Detect content type
-    content_type = mimetypes.guess_type(file_path)[0]
+    content_type = content_type or guess_content_type(file_path)
+    if compress:
+        result = upload_compressed(aws_s3_client, bucket_name, file_path, key, content_type)
+        if result is not None:
+            return result
     extra_args = {}
     if content_type:
         extra_args['ContentType'] = content_type
@@ -184,80 +931,703 @@ def upload_small_file(aws_s3_client, bucket_name, file_path, key=None):
         return False
 
 
-def upload_large_file(aws_s3_client, bucket_name, file_path, key=None, part_size=10 * 1024 * 1024):
+def parse_size(value):
     """
-    Upload a large file using multipart upload
-    part_size is in bytes (default 10MB)
+    Parse a size such as "auto", "8388608", "16MB" or "1GB" into bytes
+    Returns None for "auto"
     """
-    if key is None:
-        key = os.path.basename(file_path)
+    value = str(value).strip().upper()
+    if value == 'AUTO':
+        return None
+    units = {'KB': 1024, 'MB': MB, 'GB': 1024 * MB, 'K': 1024, 'M': MB, 'G': 1024 * MB, 'B': 1}
+    for suffix, factor in units.items():
+        if value.endswith(suffix):
+            return int(float(value[:-len(suffix)]) * factor)
+    return int(value)
 
-    content_type = mimetypes.guess_type(file_path)[0]
 
-    file_size = os.path.getsize(file_path)
+def parse_concurrency(value):
+    """
+    Parse "auto" or a worker count, returns None for "auto"
+    """
+    value = str(value).strip().lower()
+    if value == 'auto':
+        return None
+    count = int(value)
+    if count < 1:
+        raise ValueError("concurrency must be at least 1")
+    return count
+
+
+def choose_part_size(file_size, part_size=None):
+    """
+    Pick a multipart part size for a file
+
+    Aims for at most ~1000 parts between 10MB and 64MB, then grows the part
+    so the upload stays under the 10,000 part limit
+    """
+    if part_size is None:
+        part_size = min(max(math.ceil(file_size / 1000), DEFAULT_PART_SIZE), 64 * MB)
+    part_size = max(part_size, math.ceil(file_size / MAX_PARTS), MIN_PART_SIZE)
+    part_size = math.ceil(part_size / MB) * MB
+    return min(part_size, MAX_PART_SIZE)
+
+
+def should_use_multipart(file_size, part_size=None):
+    """
+    Multipart pays off once a file spans a couple of parts
+    """
+    threshold = MULTIPART_THRESHOLD if part_size is None else 2 * max(part_size, MIN_PART_SIZE)
+    return file_size >= threshold
+
+
+class ConcurrencyTuner:
+    """
+    Adjusts how many part transfers run at once from measured throughput
+
+    Every window of finished parts the aggregate throughput is compared with
+    the previous window. The limit keeps moving in the same direction while
+    throughput improves, turns around when it drops, and steps down when
+    throughput is flat but per-part latency grows (requests just queue)
+    """
+
+    def __init__(self, concurrency=None, minimum=1, maximum=MAX_CONCURRENCY):
+        if concurrency is not None:
+            minimum = maximum = concurrency
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = concurrency or min(DEFAULT_CONCURRENCY, maximum)
+        self.active = 0
+        self._direction = 1
+        self._previous = None
+        self._condition = Condition()
+        self._reset_window()
+
+    def _reset_window(self):
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._window_latency = 0.0
+        self._window_parts = 0
+
+    def acquire(self):
+        with self._condition:
+            while self.active >= self.limit:
+                self._condition.wait()
+            self.active += 1
+
+    def release(self, nbytes, seconds):
+        with self._condition:
+            self.active -= 1
+            self._window_bytes += nbytes
+            self._window_latency += seconds
+            self._window_parts += 1
+            if self.minimum != self.maximum and self._window_parts >= max(2 * self.limit, 4):
+                self._adjust()
+            self._condition.notify_all()
+
+    def _adjust(self):
+        elapsed = max(time.monotonic() - self._window_start, 1e-6)
+        throughput = self._window_bytes / elapsed
+        latency = self._window_latency / self._window_parts
+        if self._previous is not None:
+            previous_throughput, previous_latency = self._previous
+            if throughput < previous_throughput * 0.95:
+                self._direction = -self._direction
+            elif throughput < previous_throughput * 1.05 and latency > previous_latency * 1.2:
+                self._direction = -1
+        self.limit = max(self.minimum, min(self.maximum, self.limit + self._direction))
+        self._previous = (throughput, latency)
+        self._reset_window()
+
+
+class PartCancelled(Exception):
+    """
+    Raised by a PartReader whose part is no longer needed
+    """
+
+
+class PartReader:
+    """
+    Read-only, seekable window over one part of a file
+
+    boto3 streams the body from it in small reads (and rewinds it on
+    retries), so an in-flight part never exists as one big bytes object.
+    An optional hashlib digest is fed each byte once as it is read, so the
+    part is hashed on the way out instead of in a second pass. Once the
+    optional cancelled() returns True reads raise PartCancelled, which
+    stops the request mid-body
+    """
+
+    def __init__(self, file_path, offset, length, digest=None, cancelled=None):
+        self._file = open(file_path, 'rb')
+        self._offset = offset
+        self._length = length
+        self._position = 0
+        self.digest = digest
+        self._hashed = 0
+        self._cancelled = cancelled
+
+    def read(self, size=-1):
+        if self._cancelled is not None and self._cancelled():
+            raise PartCancelled()
+        remaining = self._length - self._position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        if size <= 0:
+            return b''
+        self._file.seek(self._offset + self._position)
+        data = self._file.read(size)
+        start = self._position
+        self._position += len(data)
+        # Re-reads after a rewind are not hashed again
+        if self.digest is not None and start <= self._hashed < self._position:
+            self.digest.update(memoryview(data)[self._hashed - start:])
+            self._hashed = self._position
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self._length
+        self._position = max(0, min(offset, self._length))
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def __len__(self):
+        return self._length
 
-    if file_size < 100 * 1024 * 1024:
-        return upload_small_file(aws_s3_client, bucket_name, file_path, key)
+    def close(self):
+        self._file.close()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ByteBudget:
+    """
+    Hard cap on the number of bytes in flight across worker threads
+    A single request larger than the cap is let through on its own
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self._condition = Condition()
+
+    def acquire(self, size):
+        with self._condition:
+            while self.in_use and self.in_use + size > self.limit:
+                self._condition.wait()
+            self.in_use += size
+
+    def release(self, size):
+        with self._condition:
+            self.in_use -= size
+            self._condition.notify_all()
+
+
+def upload_checkpoint_path(file_path, bucket_name, key):
+    """
+    Default location in cache_dir() of the resume checkpoint for uploading
+    file_path to bucket_name/key
+    """
+    upload_id = f"{os.path.abspath(file_path)}\ns3://{bucket_name}/{key}"
+    return os.path.join(cache_dir(), f"upload-{hashlib.sha256(upload_id.encode()).hexdigest()[:32]}.json")
+
+
+def load_json_state(path):
+    """
+    Read a local JSON state file (checkpoint, manifest), None if there is none
+    """
     try:
-        mpu = aws_s3_client.create_multipart_upload(
-            Bucket=bucket_name,
-            Key=key,
-            ContentType=content_type if content_type else 'application/octet-stream'
-        )
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
 
-        num_parts = math.ceil(file_size / part_size)
 
-        parts_lock = Lock()
-        parts = []
+def save_json_state(path, state):
+    """
+    Atomically write a local JSON state file
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
 
-        def upload_part(part_number):
-            offset = (part_number - 1) * part_size
 
-            bytes_range = min(part_size, file_size - offset)
+def _part_checksums(response):
+    # Additional checksums a completed part has to repeat
+    return {name: response[name] for name in PART_CHECKSUM_FIELDS if name in response}
 
-            with open(file_path, 'rb') as f:
-                f.seek(offset)
-                part_data = f.read(bytes_range)
 
-            response = aws_s3_client.upload_part(
+def list_uploaded_parts(aws_s3_client, bucket_name, key, upload_id):
+    """
+    List every part already stored for a multipart upload, keyed by part number
+    """
+    parts = {}
+    kwargs = {'Bucket': bucket_name, 'Key': key, 'UploadId': upload_id}
+    while True:
+        response = aws_s3_client.list_parts(**kwargs)
+        for part in response.get('Parts', []):
+            parts[part['PartNumber']] = {
+                'PartNumber': part['PartNumber'],
+                'ETag': part['ETag'],
+                'Size': part['Size'],
+                **_part_checksums(part)
+            }
+        if not response.get('IsTruncated'):
+            return parts
+        kwargs['PartNumberMarker'] = response['NextPartNumberMarker']
+
+
+def etag_is_md5(response):
+    """
+    Whether the ETag in a put/head response is an MD5 of the data, it is
+    not for SSE-KMS, DSSE-KMS and SSE-C objects
+    """
+    return (not (response.get('ServerSideEncryption') or '').startswith('aws:kms')
+            and not response.get('SSECustomerAlgorithm'))
+
+
+def _composite_etag(part_etags):
+    digests = b''.join(bytes.fromhex(etag.strip('"')) for etag in part_etags)
+    return f"{hashlib.md5(digests, usedforsecurity=False).hexdigest()}-{len(part_etags)}"
+
+
+def upload_large_file(aws_s3_client, bucket_name, file_path, key=None, part_size=None,
+                      resume=False, checkpoint_path=None, max_workers=None, max_in_flight=None,
+                      content_type=None, checksum_algorithm='SHA256', compress=False,
+                      part_retries=3, hedge_percentile=None):
+    """
+    Upload a large file using multipart upload
+    part_size is in bytes, None picks one from the file size
+    max_workers is the number of parallel parts, None tunes it while uploading
+    Parts are streamed from the file, max_in_flight caps the bytes being
+    sent at once (default part_size * max_workers)
+    With resume=True the upload id and finished parts are kept in a local
+    checkpoint, so a failed upload is not aborted and a later call only
+    sends the parts that are missing
+
+    Each part is MD5 hashed while it streams and checked against the ETag
+    S3 returns, and the composite ETag is checked after completion.
+    checksum_algorithm (SHA256, SHA1, CRC32, or CRC32C with awscrt) adds an
+    S3 additional checksum that botocore sends as a trailer of the same
+    stream, None turns it off
+    compress=True streams compressible types through gzip instead, those
+    uploads cannot be resumed
+
+    Each part is retried part_retries times with jittered backoff before the
+    upload fails. With hedge_percentile (e.g. 0.95) a part still running
+    past that percentile of the finished parts' latencies is sent a second
+    time on a small extra pool and whichever copy lands first is kept, so a
+    single slow connection does not hold up the whole upload
+    """
+    if key is None:
+        key = os.path.basename(file_path)
+
+    content_type = content_type or guess_content_type(file_path)
+
+    file_stat = os.stat(file_path)
+    file_size = file_stat.st_size
+
+    if not should_use_multipart(file_size, part_size):
+        return upload_small_file(aws_s3_client, bucket_name, file_path, key, content_type, compress)
+
+    part_size = choose_part_size(file_size, part_size)
+
+    if compress:
+        result = upload_compressed(aws_s3_client, bucket_name, file_path, key, content_type,
+                                   part_size=part_size, max_workers=max_workers or DEFAULT_CONCURRENCY)
+        if result is not None:
+            return result
+
+    if checkpoint_path is None:
+        checkpoint_path = upload_checkpoint_path(file_path, bucket_name, key)
+
+    checkpoint = None
+    done_parts = {}
+    if resume:
+        checkpoint = load_json_state(checkpoint_path)
+        if checkpoint and (checkpoint.get('bucket') != bucket_name
+                           or checkpoint.get('key') != key
+                           or checkpoint.get('file_size') != file_size
+                           or checkpoint.get('mtime_ns') != file_stat.st_mtime_ns
+                           or checkpoint.get('checksum_algorithm') != checksum_algorithm):
+            print("Checkpoint does not match the file, starting a new upload")
+            checkpoint = None
+        if checkpoint:
+            part_size = checkpoint['part_size']
+            try:
+                done_parts = list_uploaded_parts(aws_s3_client, bucket_name, key, checkpoint['upload_id'])
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'NoSuchUpload':
+                    print(f"Error in multipart upload: {e}")
+                    return False
+                print("Previous upload no longer exists, starting a new upload")
+                checkpoint = None
+                done_parts = {}
+
+    num_parts = math.ceil(file_size / part_size)
+
+    # Parts from an earlier attempt only count if they have the expected size
+    for part_number in list(done_parts):
+        expected = min(part_size, file_size - (part_number - 1) * part_size)
+        if part_number > num_parts or done_parts[part_number].pop('Size') != expected:
+            del done_parts[part_number]
+
+    upload_id = None
+    checkpoint_saved = False
+    try:
+        checksum_args = {'ChecksumAlgorithm': checksum_algorithm} if checksum_algorithm else {}
+        if checkpoint is None:
+            mpu = aws_s3_client.create_multipart_upload(
                 Bucket=bucket_name,
                 Key=key,
-                PartNumber=part_number,
-                UploadId=mpu['UploadId'],
-                Body=part_data
+                ContentType=content_type if content_type else 'application/octet-stream',
+                **checksum_args
             )
+            checkpoint = {
+                'bucket': bucket_name,
+                'key': key,
+                'upload_id': mpu['UploadId'],
+                'file_size': file_size,
+                'mtime_ns': file_stat.st_mtime_ns,
+                'part_size': part_size,
+                'checksum_algorithm': checksum_algorithm,
+                'parts': {}
+            }
+        upload_id = checkpoint['upload_id']
+        checkpoint['parts'] = {str(number): part['ETag'] for number, part in done_parts.items()}
+        if resume:
+            save_json_state(checkpoint_path, checkpoint)
+            checkpoint_saved = True
+            if done_parts:
+                print(f"Resuming upload, {len(done_parts)} of {num_parts} parts already uploaded")
+
+        parts = list(done_parts.values())
+        tuner = ConcurrencyTuner(max_workers)
+        budget = ByteBudget(max_in_flight or part_size * tuner.maximum)
+        started_at = {}
+        # Parts that have a winning copy; the other copy stops sending, and
+        # everything stops once the upload is over either way
+        settled = set()
+        finished = Event()
+
+        def send_part(part_number, offset, bytes_range):
+            def cancelled():
+                return finished.is_set() or part_number in settled
+
+            if cancelled():
+                raise PartCancelled()
+            with PartReader(file_path, offset, bytes_range, hashlib.md5(usedforsecurity=False),
+                            cancelled) as part_data:
+                response = aws_s3_client.upload_part(
+                    Bucket=bucket_name,
+                    Key=key,
+                    PartNumber=part_number,
+                    UploadId=upload_id,
+                    ContentLength=bytes_range,
+                    Body=part_data,
+                    **checksum_args
+                )
+                md5 = part_data.digest.hexdigest()
+            if etag_is_md5(response) and response['ETag'].strip('"') != md5:
+                raise ValueError(f"Part {part_number} ETag {response['ETag']} does not match its MD5 {md5}")
+            return response
 
-            with parts_lock:
-                parts.append({
-                    'PartNumber': part_number,
-                    'ETag': response['ETag']
-                })
+        def upload_part(part_number, hedge=False):
+            offset = (part_number - 1) * part_size
 
-        with ThreadPoolExecutor(max_workers=min(num_parts, 4)) as executor:
-            executor.map(upload_part, range(1, num_parts + 1))
+            bytes_range = min(part_size, file_size - offset)
 
-        aws_s3_client.complete_multipart_upload(
+            # Hedges are extra copies on their own small pool, outside the tuner and budget
+            if not hedge:
+                tuner.acquire()
+                budget.acquire(bytes_range)
+            started = time.monotonic()
+            started_at.setdefault(part_number, started)
+            try:
+                response, _ = call_with_retries(lambda: send_part(part_number, offset, bytes_range),
+                                                attempts=part_retries + 1)
+            finally:
+                if not hedge:
+                    budget.release(bytes_range)
+                    tuner.release(bytes_range, time.monotonic() - started)
+            return response, time.monotonic() - started
+
+        missing = [n for n in range(1, num_parts + 1) if n not in done_parts]
+        if missing:
+            executor = ThreadPoolExecutor(max_workers=min(len(missing), tuner.maximum))
+            hedger = ThreadPoolExecutor(max_workers=HEDGE_WORKERS) if hedge_percentile else None
+            running = {executor.submit(upload_part, n): n for n in missing}
+            hedged = set()
+            latencies = []
+            failed = True
+            try:
+                while running:
+                    done, _ = wait(running, timeout=0.05 if hedger else None, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        part_number = running.pop(future, None)
+                        if part_number is None:
+                            continue
+                        try:
+                            response, seconds = future.result()
+                        except Exception:
+                            # The other copy of a hedged part may still make it
+                            if part_number in running.values():
+                                continue
+                            raise
+                        # First copy wins, the other one gives up at its next read
+                        settled.add(part_number)
+                        for other in [f for f, n in running.items() if n == part_number]:
+                            del running[other]
+                        latencies.append(seconds)
+                        parts.append({
+                            'PartNumber': part_number,
+                            'ETag': response['ETag'],
+                            **_part_checksums(response)
+                        })
+                        if resume:
+                            checkpoint['parts'][str(part_number)] = response['ETag']
+                            save_json_state(checkpoint_path, checkpoint)
+
+                    if hedger and len(latencies) >= HEDGE_MIN_SAMPLES:
+                        threshold = sorted(latencies)[int(hedge_percentile * (len(latencies) - 1))]
+                        now = time.monotonic()
+                        for part_number in set(running.values()) - hedged:
+                            if now - started_at.get(part_number, now) > threshold:
+                                hedged.add(part_number)
+                                running[hedger.submit(upload_part, part_number, True)] = part_number
+                failed = False
+            finally:
+                # Stop the copies still sending; after a failure wait for them,
+                # so an abort is not raced by a part landing late
+                finished.set()
+                executor.shutdown(wait=failed, cancel_futures=True)
+                if hedger:
+                    hedger.shutdown(wait=failed, cancel_futures=True)
+            if hedged:
+                print(f"Hedged {len(hedged)} slow parts")
+
+        parts.sort(key=lambda x: x['PartNumber'])
+        response = aws_s3_client.complete_multipart_upload(
             Bucket=bucket_name,
             Key=key,
-            UploadId=mpu['UploadId'],
-            MultipartUpload={'Parts': sorted(parts, key=lambda x: x['PartNumber'])}
+            UploadId=upload_id,
+            MultipartUpload={'Parts': parts}
         )
+        expected_etag = _composite_etag([part['ETag'] for part in parts])
+        if etag_is_md5(response) and response['ETag'].strip('"') != expected_etag:
+            # The object is already in place, keep it but say so loudly
+            print(f"Warning: {key} has ETag {response['ETag']}, expected {expected_etag} from the uploaded parts")
+            return False
+
+        if resume and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
 
         return True
 
     except Exception as e:
         print(f"Error in multipart upload: {e}")
 
-        if 'mpu' in locals():
+        if upload_id is None:
+            return False
+
+        # Resuming only needs the upload id; without it the upload would be orphaned
+        if resume and checkpoint_saved:
+            print(f"Upload state kept in {checkpoint_path}, retry with resume to continue")
+        else:
             aws_s3_client.abort_multipart_upload(
                 Bucket=bucket_name,
                 Key=key,
-                UploadId=mpu['UploadId']
+                UploadId=upload_id
             )
         return False
 
 
+def _write_at(fd, data, offset):
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+def _file_md5(file_path, chunk_size=8 * MB):
+    digest = hashlib.md5(usedforsecurity=False)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def compute_etag(file_path, part_size=None):
+    """
+    ETag S3 would give the file, the multipart form when part_size is set
+    """
+    if part_size is None:
+        return _file_md5(file_path)
+    digests = []
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(part_size), b''):
+            digests.append(hashlib.md5(chunk, usedforsecurity=False).digest())
+    if len(digests) <= 1:
+        return _file_md5(file_path)
+    return f"{hashlib.md5(b''.join(digests), usedforsecurity=False).hexdigest()}-{len(digests)}"
+
+
+def etag_matches(file_path, etag, file_size=None):
+    """
+    Check a local file against a remote ETag
+    Multipart ETags are tried with the part sizes this tool and boto3 use
+    """
+    etag = etag.strip('"')
+    if '-' not in etag:
+        return compute_etag(file_path) == etag
+    if file_size is None:
+        file_size = os.path.getsize(file_path)
+    num_parts = int(etag.split('-')[1])
+    candidates = {8 * MB, DEFAULT_PART_SIZE, choose_part_size(file_size)}
+    for part_size in sorted(candidates):
+        if math.ceil(file_size / part_size) == num_parts and compute_etag(file_path, part_size) == etag:
+            return True
+    return False
+
+
+def download_large_file(aws_s3_client, bucket_name, key, file_path=None, part_size=None, max_workers=None):
+    """
+    Download an object with parallel ranged GETs
+    Each range is written straight to its offset in a preallocated
+    temporary file, which replaces file_path only once the size and ETag
+    are checked
+    part_size and max_workers work like in upload_large_file
+    """
+    if file_path is None:
+        file_path = os.path.basename(key)
+
+    try:
+        head = aws_s3_client.head_object(Bucket=bucket_name, Key=key)
+    except ClientError as e:
+        print(f"Error reading object: {e}")
+        return False
+
+    size = head['ContentLength']
+    etag = head['ETag'].strip('"')
+    etag_parts = int(etag.split('-')[1]) if '-' in etag else None
+
+    # Ranges that line up with the uploaded parts give the part MD5s,
+    # so a multipart ETag can be checked without reading the file again
+    if etag_parts and part_size is None:
+        try:
+            part_size = aws_s3_client.head_object(
+                Bucket=bucket_name, Key=key, PartNumber=1)['ContentLength']
+        except ClientError:
+            part_size = None
+        if part_size and math.ceil(size / part_size) != etag_parts:
+            part_size = None
+    if not part_size:
+        part_size = choose_part_size(size, part_size)
+
+    num_ranges = max(math.ceil(size / part_size), 1)
+    tuner = ConcurrencyTuner(max_workers)
+    # Ranges land in a temporary file next to file_path that only replaces
+    # it once the checks pass, so a failed download never touches an existing file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file_path)),
+                                    prefix=f".{os.path.basename(file_path)}.", suffix='.part')
+    try:
+        os.fchmod(fd, 0o644)
+        if size:
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(fd, 0, size)
+            else:
+                os.ftruncate(fd, size)
+
+        def fetch_range(index):
+            start = index * part_size
+            end = min(start + part_size, size) - 1
+            tuner.acquire()
+            started = time.monotonic()
+            try:
+                response = aws_s3_client.get_object(
+                    Bucket=bucket_name,
+                    Key=key,
+                    Range=f"bytes={start}-{end}",
+                    IfMatch=head['ETag']
+                )
+                digest = hashlib.md5(usedforsecurity=False)
+                offset = start
+                for chunk in response['Body'].iter_chunks(MB):
+                    _write_at(fd, chunk, offset)
+                    digest.update(chunk)
+                    offset += len(chunk)
+                if offset != end + 1:
+                    raise IOError(f"Short read for bytes {start}-{end}")
+                return digest.digest()
+            finally:
+                tuner.release(end + 1 - start, time.monotonic() - started)
+
+        digests = []
+        if size:
+            with ThreadPoolExecutor(max_workers=min(num_ranges, tuner.maximum)) as executor:
+                digests = list(executor.map(fetch_range, range(num_ranges)))
+        os.fsync(fd)
+        os.close(fd)
+        fd = None
+
+        if _downloaded_file_matches(tmp_path, head, size, etag, etag_parts, digests):
+            os.replace(tmp_path, file_path)
+            tmp_path = None
+            return True
+        return False
+    except Exception as e:
+        print(f"Error downloading file: {e}")
+        return False
+    finally:
+        if fd is not None:
+            os.close(fd)
+        if tmp_path is not None:
+            os.remove(tmp_path)
+
+
+def _downloaded_file_matches(file_path, head, size, etag, etag_parts, digests):
+    # Size, then the ETag where it is an MD5 of the content or its parts
+    if os.path.getsize(file_path) != size:
+        print(f"Size mismatch: expected {size} bytes, got {os.path.getsize(file_path)}")
+        return False
+
+    if not etag_is_md5(head):
+        print("ETag is not an MD5 for this encryption type, checked size only")
+        return True
+
+    if etag_parts:
+        if len(digests) != etag_parts:
+            print("Object was not uploaded with a known part size, checked size only")
+            return True
+        local_etag = f"{hashlib.md5(b''.join(digests), usedforsecurity=False).hexdigest()}-{etag_parts}"
+    elif len(digests) == 1:
+        local_etag = digests[0].hex()
+    else:
+        local_etag = _file_md5(file_path)
+
+    if size and local_etag != etag:
+        print(f"ETag mismatch: expected {etag}, got {local_etag}")
+        return False
+    return True
+
+
 def set_lifecycle_policy(aws_s3_client, bucket_name, prefix="", days=120):
     """
     Set a lifecycle policy to delete objects after specified days
@@ -284,9 +1654,10 @@ def set_lifecycle_policy(aws_s3_client, bucket_name, prefix="", days=120):
         return False
 
 
-def validate_mime_type(file_path, allowed_types=None):
+def validate_mime_type(file_path, allowed_types=None, content_type=None):
     """
     Validate if file's MIME type is in allowed types
+    content_type skips detection when the caller already classified the file
     """
     if allowed_types is None:
         allowed_types = [
@@ -298,7 +1669,7 @@ def validate_mime_type(file_path, allowed_types=None):
             'application/json'
         ]
 
-    mime_type = mimetypes.guess_type(file_path)[0]
+    mime_type = content_type or guess_content_type(file_path)
     if mime_type is None:
         return False
 
@@ -318,6 +1689,94 @@ def delete_file(aws_s3_client, bucket_name, file_key):
         return False
 
 
+def _delete_batches(items, batch_size):
+    batch = []
+    for item in items:
+        key, version_id = (item, None) if isinstance(item, str) else item
+        entry = {'Key': key}
+        if version_id:
+            entry['VersionId'] = version_id
+        batch.append(entry)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def delete_objects_batched(aws_s3_client, bucket_name, items, max_workers=4, batch_size=1000):
+    """
+    Delete many objects with DeleteObjects, 1000 keys per request
+
+    items is an iterable of keys or (key, version_id) pairs, consumed lazily
+    while up to max_workers batches are in flight
+    Returns the number of deleted entries and a list of per-key errors
+    """
+    errors = []
+    deleted = [0]
+    lock = Lock()
+    slots = BoundedSemaphore(max_workers)
+
+    def delete_batch(batch):
+        try:
+            response = aws_s3_client.delete_objects(
+                Bucket=bucket_name,
+                Delete={'Objects': batch, 'Quiet': True}
+            )
+            batch_errors = response.get('Errors', [])
+        except Exception as e:
+            batch_errors = [dict(entry, Code='RequestFailed', Message=str(e)) for entry in batch]
+        finally:
+            slots.release()
+        with lock:
+            deleted[0] += len(batch) - len(batch_errors)
+            errors.extend(batch_errors)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for batch in _delete_batches(items, batch_size):
+            slots.acquire()
+            executor.submit(delete_batch, batch)
+
+    return deleted[0], errors
+
+
+def iter_object_versions(aws_s3_client, bucket_name, prefix=""):
+    """
+    Yield every version and delete marker under prefix, page by page
+    Delete markers carry IsDeleteMarker=True
+    """
+    kwargs = {'Bucket': bucket_name, 'Prefix': prefix}
+    while True:
+        response = aws_s3_client.list_object_versions(**kwargs)
+        for version in response.get('Versions', []):
+            yield dict(version, IsDeleteMarker=False)
+        for marker in response.get('DeleteMarkers', []):
+            yield dict(marker, IsDeleteMarker=True)
+        if not response.get('IsTruncated'):
+            return
+        kwargs['KeyMarker'] = response['NextKeyMarker']
+        kwargs['VersionIdMarker'] = response['NextVersionIdMarker']
+
+
+def purge_prefix(aws_s3_client, bucket_name, prefix, all_versions=False, max_workers=4, index=None):
+    """
+    Delete every object under prefix, with all_versions=True also every
+    old version and delete marker
+    With a BucketIndex the keys come from the index instead of a listing
+    Returns the number of deleted entries and a list of per-key errors
+    """
+    if all_versions:
+        items = ((v['Key'], v['VersionId']) for v in iter_object_versions(aws_s3_client, bucket_name, prefix))
+    elif index is not None:
+        items = (obj['Key'] for obj in index.iter_objects(bucket_name, prefix))
+    else:
+        items = (obj['Key'] for obj in iter_objects(aws_s3_client, bucket_name, prefix, parallel=True))
+    deleted, errors = delete_objects_batched(aws_s3_client, bucket_name, items, max_workers)
+    if index is not None and not errors:
+        index.drop_prefix(bucket_name, prefix)
+    return deleted, errors
+
+
 def get_bucket_versioning(aws_s3_client, bucket_name):
     """Get bucket versioning status"""
     try:
@@ -329,22 +1788,275 @@ def get_bucket_versioning(aws_s3_client, bucket_name):
         return False
 
 
-def list_file_versions(aws_s3_client, bucket_name, file_name):
-    """List all versions of a specific file"""
+def iter_key_versions(aws_s3_client, bucket_name, file_name):
+    """
+    Yield the versions and delete markers of exactly one key, newest first
+    Listing stops as soon as it passes the key instead of walking every key
+    that shares it as a prefix
+    """
+    kwargs = {'Bucket': bucket_name, 'Prefix': file_name}
+    while True:
+        response = aws_s3_client.list_object_versions(**kwargs)
+        entries = [dict(v, IsDeleteMarker=False) for v in response.get('Versions', [])]
+        entries += [dict(m, IsDeleteMarker=True) for m in response.get('DeleteMarkers', [])]
+        matching = [e for e in entries if e['Key'] == file_name]
+        yield from sorted(matching, key=lambda e: e['LastModified'], reverse=True)
+        if not response.get('IsTruncated') or any(e['Key'] > file_name for e in entries):
+            return
+        kwargs['KeyMarker'] = response['NextKeyMarker']
+        kwargs['VersionIdMarker'] = response['NextVersionIdMarker']
+
+
+def cache_dir():
+    """
+    Directory for local caches and indexes (aws_s3_cli_cache_dir overrides it)
+    """
+    load_env()
+    path = getenv("aws_s3_cli_cache_dir") or os.path.join(os.path.expanduser("~"), ".cache", "s3-cli")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class VersionIndex:
+    """
+    Local SQLite index of object versions
+
+    A key listed less than max_age seconds ago is answered from the index.
+    Otherwise versions are listed newest first until one already in the
+    index shows up, so only versions created since the last query are
+    fetched; indexed versions from that point on that the listing no longer
+    shows were deleted elsewhere and are dropped. Deletions of older
+    versions (lifecycle rules, other clients) are picked up by a full
+    re-listing once the last one is older than full_max_age seconds
+    """
+
+    def __init__(self, path=None, max_age=300, full_max_age=86400):
+        self.path = path or os.path.join(cache_dir(), "versions.sqlite")
+        self.max_age = max_age
+        self.full_max_age = full_max_age
+        self._lock = Lock()
+        import sqlite3
+
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS versions (
+                bucket TEXT, key TEXT, version_id TEXT, last_modified TEXT,
+                is_delete_marker INTEGER, size INTEGER, etag TEXT,
+                PRIMARY KEY (bucket, key, version_id));
+            CREATE TABLE IF NOT EXISTS refreshed (
+                bucket TEXT, key TEXT, refreshed_at REAL, PRIMARY KEY (bucket, key));
+        """)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(refreshed)")}
+        if 'full_refreshed_at' not in columns:
+            self._db.execute("ALTER TABLE refreshed ADD COLUMN full_refreshed_at REAL")
+
+    def refresh(self, aws_s3_client, bucket_name, file_name, full=False):
+        """
+        Bring the index for one key up to date with S3, full=True re-lists
+        every version instead of stopping at the first one already indexed
+        """
+        with self._lock:
+            known = {row[0]: row[1] for row in self._db.execute(
+                "SELECT version_id, last_modified FROM versions WHERE bucket = ? AND key = ?",
+                (bucket_name, file_name))}
+            seen = set()
+            anchor = None
+            rows = []
+            for version in iter_key_versions(aws_s3_client, bucket_name, file_name):
+                seen.add(version['VersionId'])
+                if not full and version['VersionId'] in known:
+                    anchor = known[version['VersionId']]
+                    break
+                rows.append((bucket_name, file_name, version['VersionId'], version['LastModified'].isoformat(),
+                             int(version['IsDeleteMarker']), version.get('Size'), version.get('ETag')))
+            # The listing is complete down to the anchor (everything when none was hit);
+            # versions tied with the anchor's time are left to the next full refresh
+            gone = [(bucket_name, file_name, version_id) for version_id, last_modified in known.items()
+                    if version_id not in seen and (anchor is None or last_modified > anchor)]
+            self._db.executemany("DELETE FROM versions WHERE bucket = ? AND key = ? AND version_id = ?", gone)
+            self._db.executemany("INSERT OR REPLACE INTO versions VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            now = time.time()
+            if anchor is None:
+                self._db.execute("INSERT OR REPLACE INTO refreshed VALUES (?, ?, ?, ?)",
+                                 (bucket_name, file_name, now, now))
+            else:
+                self._db.execute("UPDATE refreshed SET refreshed_at = ? WHERE bucket = ? AND key = ?",
+                                 (now, bucket_name, file_name))
+            self._db.commit()
+
+    def versions(self, aws_s3_client, bucket_name, file_name, include_delete_markers=False, full=False):
+        row = self._db.execute("SELECT refreshed_at, full_refreshed_at FROM refreshed WHERE bucket = ? AND key = ?",
+                               (bucket_name, file_name)).fetchone()
+        now = time.time()
+        if full or row is None or row[1] is None or now - row[1] > self.full_max_age:
+            self.refresh(aws_s3_client, bucket_name, file_name, full=True)
+        elif now - row[0] > self.max_age:
+            self.refresh(aws_s3_client, bucket_name, file_name)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT version_id, last_modified, is_delete_marker FROM versions "
+                "WHERE bucket = ? AND key = ? ORDER BY last_modified DESC", (bucket_name, file_name)).fetchall()
+        versions = []
+        for position, (version_id, last_modified, is_delete_marker) in enumerate(rows):
+            if is_delete_marker and not include_delete_markers:
+                continue
+            versions.append({
+                'VersionId': version_id,
+                'LastModified': datetime.fromisoformat(last_modified),
+                'IsLatest': position == 0,
+                'IsDeleteMarker': bool(is_delete_marker)
+            })
+        return versions
+
+    def forget(self, bucket_name, file_name, version_ids):
+        with self._lock:
+            self._db.executemany("DELETE FROM versions WHERE bucket = ? AND key = ? AND version_id = ?",
+                                 [(bucket_name, file_name, v) for v in version_ids])
+            self._db.commit()
+
+
+def _prefix_range(prefix):
+    # Keys starting with prefix are exactly those in [prefix, upper)
+    if not prefix:
+        return '', '\U0010ffff'
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _extension(key):
+    return key.split('.')[-1] if '.' in key else ''
+
+
+class BucketIndex:
+    """
+    Local SQLite inventory of bucket contents
+
+    refresh() streams the listing into a scratch table and then only writes
+    rows that are new or changed and drops keys that are gone, so re-indexing
+    an unchanged prefix leaves the inventory untouched. Queries (extension
+    counts, size by prefix, largest and oldest objects) run on the index
+    without touching S3, and iter_objects() gives bulk commands a work list
+    """
+
+    def __init__(self, path=None):
+        import sqlite3
+
+        self.path = path or os.path.join(cache_dir(), "inventory.sqlite")
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.create_function("extension", 1, _extension, deterministic=True)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS objects (
+                bucket TEXT, key TEXT, size INTEGER, etag TEXT, last_modified TEXT, storage_class TEXT,
+                PRIMARY KEY (bucket, key));
+            CREATE INDEX IF NOT EXISTS objects_size ON objects (bucket, size);
+            CREATE TABLE IF NOT EXISTS refreshes (
+                bucket TEXT, prefix TEXT, refreshed_at REAL, objects INTEGER, PRIMARY KEY (bucket, prefix));
+        """)
+
+    def refresh(self, aws_s3_client, bucket_name, prefix="", parallel=True):
+        """
+        Re-list bucket_name/prefix into the index, returns (objects, changed, removed)
+        """
+        low, high = _prefix_range(prefix)
+        db = self._db
+        db.execute("DROP TABLE IF EXISTS temp.listing")
+        db.execute("CREATE TEMP TABLE listing (key TEXT PRIMARY KEY, size INTEGER, etag TEXT, "
+                   "last_modified TEXT, storage_class TEXT)")
+        batch = []
+        objects = 0
+        for obj in iter_objects(aws_s3_client, bucket_name, prefix, parallel=parallel):
+            batch.append((obj['Key'], obj['Size'], obj['ETag'].strip('"'),
+                          obj['LastModified'].astimezone(timezone.utc).isoformat(),
+                          obj.get('StorageClass', 'STANDARD')))
+            if len(batch) == 5000:
+                db.executemany("INSERT OR REPLACE INTO temp.listing VALUES (?, ?, ?, ?, ?)", batch)
+                objects += len(batch)
+                batch = []
+        db.executemany("INSERT OR REPLACE INTO temp.listing VALUES (?, ?, ?, ?, ?)", batch)
+        objects += len(batch)
+
+        changed = db.execute("""
+            INSERT OR REPLACE INTO objects
+            SELECT ?, l.key, l.size, l.etag, l.last_modified, l.storage_class FROM temp.listing l
+            LEFT JOIN objects o ON o.bucket = ? AND o.key = l.key
+            WHERE o.key IS NULL OR o.etag != l.etag OR o.size != l.size
+               OR o.last_modified != l.last_modified OR o.storage_class != l.storage_class
+        """, (bucket_name, bucket_name)).rowcount
+        removed = db.execute("""
+            DELETE FROM objects WHERE bucket = ? AND key >= ? AND key < ?
+              AND key NOT IN (SELECT key FROM temp.listing)
+        """, (bucket_name, low, high)).rowcount
+        db.execute("INSERT OR REPLACE INTO refreshes VALUES (?, ?, ?, ?)",
+                   (bucket_name, prefix, time.time(), objects))
+        db.execute("DROP TABLE temp.listing")
+        db.commit()
+        return objects, changed, removed
+
+    def extension_counts(self, bucket_name, prefix=""):
+        low, high = _prefix_range(prefix)
+        return self._db.execute(
+            "SELECT extension(key) AS ext, COUNT(*), SUM(size) FROM objects "
+            "WHERE bucket = ? AND key >= ? AND key < ? GROUP BY ext ORDER BY COUNT(*) DESC",
+            (bucket_name, low, high)).fetchall()
+
+    def size_by_prefix(self, bucket_name, prefix="", delimiter="/"):
+        """
+        Object count and total size per next-level prefix under prefix
+        """
+        low, high = _prefix_range(prefix)
+        self._db.create_function(
+            "next_prefix", 1,
+            lambda key: prefix + key[len(prefix):].split(delimiter, 1)[0]
+            + (delimiter if delimiter in key[len(prefix):] else ''))
+        return self._db.execute(
+            "SELECT next_prefix(key) AS p, COUNT(*), SUM(size) FROM objects "
+            "WHERE bucket = ? AND key >= ? AND key < ? GROUP BY p ORDER BY SUM(size) DESC",
+            (bucket_name, low, high)).fetchall()
+
+    def largest(self, bucket_name, limit=10, prefix=""):
+        low, high = _prefix_range(prefix)
+        return self._db.execute(
+            "SELECT key, size, last_modified FROM objects WHERE bucket = ? AND key >= ? AND key < ? "
+            "ORDER BY size DESC LIMIT ?", (bucket_name, low, high, limit)).fetchall()
+
+    def older_than(self, bucket_name, days, prefix=""):
+        low, high = _prefix_range(prefix)
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+        return self._db.execute(
+            "SELECT key, size, last_modified FROM objects WHERE bucket = ? AND key >= ? AND key < ? "
+            "AND last_modified < ? ORDER BY last_modified", (bucket_name, low, high, cutoff))
+
+    def iter_objects(self, bucket_name, prefix=""):
+        """
+        Indexed objects in the same shape as iter_objects yields them
+        """
+        low, high = _prefix_range(prefix)
+        rows = self._db.execute(
+            "SELECT key, size, etag, last_modified, storage_class FROM objects "
+            "WHERE bucket = ? AND key >= ? AND key < ? ORDER BY key", (bucket_name, low, high))
+        for key, size, etag, last_modified, storage_class in rows:
+            yield {'Key': key, 'Size': size, 'ETag': f'"{etag}"',
+                   'LastModified': datetime.fromisoformat(last_modified), 'StorageClass': storage_class}
+
+    def drop_prefix(self, bucket_name, prefix=""):
+        low, high = _prefix_range(prefix)
+        self._db.execute("DELETE FROM objects WHERE bucket = ? AND key >= ? AND key < ?", (bucket_name, low, high))
+        self._db.commit()
+
+
+def list_file_versions(aws_s3_client, bucket_name, file_name, index=None):
+    """List all versions of a specific file, through a VersionIndex if given"""
     try:
-        response = aws_s3_client.list_object_versions(
-            Bucket=bucket_name,
-            Prefix=file_name
-        )
+        if index is not None:
+            return [{k: v[k] for k in ('VersionId', 'LastModified', 'IsLatest')}
+                    for v in index.versions(aws_s3_client, bucket_name, file_name)]
         versions = []
-        if 'Versions' in response:
-            for version in response['Versions']:
-                if version['Key'] == file_name:
-                    versions.append({
-                        'VersionId': version['VersionId'],
-                        'LastModified': version['LastModified'],
-                        'IsLatest': version['IsLatest']
-                    })
+        for version in iter_key_versions(aws_s3_client, bucket_name, file_name):
+            if not version['IsDeleteMarker']:
+                versions.append({
+                    'VersionId': version['VersionId'],
+                    'LastModified': version['LastModified'],
+                    'IsLatest': version['IsLatest']
+                })
         return versions
     except ClientError as e:
         print(f"Error listing file versions: {e}")
@@ -355,66 +2067,389 @@ def restore_file_version(aws_s3_client, bucket_name, file_name, version_id):
     """Restore a specific version of a file as the latest version"""
     try:
         # Copy the old version to the same location, which creates a new version
-        copy_source = {
-            'Bucket': bucket_name,
-            'Key': file_name,
-            'VersionId': version_id
-        }
-        aws_s3_client.copy_object(
-            CopySource=copy_source,
-            Bucket=bucket_name,
-            Key=file_name
-        )
+        size = aws_s3_client.head_object(Bucket=bucket_name, Key=file_name, VersionId=version_id)['ContentLength']
+        server_side_copy(aws_s3_client, bucket_name, file_name, bucket_name, file_name, size,
+                         version_id=version_id, copy_metadata=True)
         return True
     except ClientError as e:
         print(f"Error restoring file version: {e}")
         return False
 
 
-def collecting_objects(bucket_name, aws_s3_client):
+def parse_timestamp(value):
+    """
+    Parse an ISO 8601 time such as 2024-05-01T12:00:00Z, UTC unless it has an offset
+    """
+    timestamp = datetime.fromisoformat(value.strip())
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+def plan_point_in_time_restore(aws_s3_client, bucket_name, prefix, as_of):
+    """
+    Work out from one version listing what restoring prefix to as_of takes
+    Returns (copies, deletes, unchanged): copies are (key, version_id, size)
+    of versions that were current at as_of, deletes are keys that exist now
+    but did not then
+    """
+    then = {}
+    now = {}
+    for version in iter_object_versions(aws_s3_client, bucket_name, prefix):
+        key = version['Key']
+        if version['IsLatest']:
+            now[key] = version
+        if version['LastModified'] <= as_of:
+            previous = then.get(key)
+            if previous is None or version['LastModified'] > previous['LastModified']:
+                then[key] = version
+
+    copies, deletes, unchanged = [], [], 0
+    for key in sorted(set(then) | set(now)):
+        target, current = then.get(key), now.get(key)
+        target_exists = target is not None and not target['IsDeleteMarker']
+        current_exists = current is not None and not current['IsDeleteMarker']
+        if target_exists:
+            if current_exists and (current['VersionId'] == target['VersionId']
+                                   or (current['ETag'] == target['ETag'] and current['Size'] == target['Size'])):
+                unchanged += 1
+            else:
+                copies.append((key, target['VersionId'], target['Size']))
+        elif current_exists:
+            deletes.append(key)
+        else:
+            unchanged += 1
+    return copies, deletes, unchanged
+
+
+def restore_prefix(aws_s3_client, bucket_name, prefix, as_of, max_workers=16, dry_run=False):
+    """
+    Bring every key under prefix back to how it was at as_of
+
+    Versions current at as_of are copied over the live keys in parallel
+    (multipart copies for big objects, keeping their headers) and keys
+    created after as_of get delete markers in 1000-key batches. Nothing is
+    removed for good, so the restore itself can be rolled back the same way
+    """
+    copies, deletes, unchanged = plan_point_in_time_restore(aws_s3_client, bucket_name, prefix, as_of)
+    summary = {'restored': 0, 'deleted': 0, 'unchanged': unchanged, 'failed': []}
+    if dry_run:
+        for key, version_id, size in copies:
+            print(f"restore {key} {version_id} ({size} bytes)")
+        for key in deletes:
+            print(f"delete {key}")
+        summary.update(restored=len(copies), deleted=len(deletes))
+        return summary
+
+    progress = TransferProgress("Restored")
+
+    def restore(item):
+        key, version_id, size = item
+        try:
+            server_side_copy(aws_s3_client, bucket_name, key, bucket_name, key, size,
+                             version_id=version_id, copy_metadata=True)
+        except Exception as e:
+            return key, str(e)
+        progress.add(size)
+        return key, None
+
+    if copies:
+        with ThreadPoolExecutor(max_workers=min(len(copies), max_workers)) as executor:
+            for key, error in executor.map(restore, copies):
+                if error:
+                    summary['failed'].append({'Key': key, 'Message': error})
+                else:
+                    summary['restored'] += 1
+
+    deleted, errors = delete_objects_batched(aws_s3_client, bucket_name, deletes)
+    summary['deleted'] = deleted
+    summary['failed'].extend(errors)
+    return summary
+
+
+def _list_object_pages(aws_s3_client, bucket_name, prefix="", delimiter=None, page_size=1000):
+    kwargs = {'Bucket': bucket_name, 'Prefix': prefix, 'MaxKeys': page_size}
+    if delimiter:
+        kwargs['Delimiter'] = delimiter
+    while True:
+        response = aws_s3_client.list_objects_v2(**kwargs)
+        yield response
+        if not response.get('IsTruncated'):
+            return
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+
+def iter_objects(aws_s3_client, bucket_name, prefix="", parallel=False, delimiter="/",
+                 max_workers=8, max_depth=2, page_size=1000):
+    """
+    Yield every object under prefix, fetching one page at a time
+
+    With parallel=True the keyspace is split on delimiter: common prefixes
+    found while listing (down to max_depth levels) are listed at the same
+    time on max_workers threads. Objects then come out in no particular
+    order, and at most a few pages are buffered at once
+    """
+    if not parallel:
+        for page in _list_object_pages(aws_s3_client, bucket_name, prefix, page_size=page_size):
+            yield from page.get('Contents', [])
+        return
+
+    done = object()
+    stop = Event()
+    pages = Queue(maxsize=2 * max_workers)
+    submitted_lock = Lock()
+    submitted = [0]
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def submit(partition, depth):
+        with submitted_lock:
+            submitted[0] += 1
+        executor.submit(list_partition, partition, depth)
+
+    def list_partition(partition, depth):
+        try:
+            partition_delimiter = delimiter if depth < max_depth else None
+            for page in _list_object_pages(aws_s3_client, bucket_name, partition,
+                                           partition_delimiter, page_size):
+                for common_prefix in page.get('CommonPrefixes', []):
+                    submit(common_prefix['Prefix'], depth + 1)
+                if page.get('Contents') and not put(page['Contents']):
+                    return
+        except Exception as e:
+            put(e)
+        finally:
+            put(done)
+
+    try:
+        submit(prefix, 0)
+        finished = 0
+        while True:
+            with submitted_lock:
+                if finished == submitted[0]:
+                    break
+            item = pages.get()
+            if item is done:
+                finished += 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield from item
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+COPIED_HEADERS = ('ContentType', 'ContentEncoding', 'CacheControl', 'ContentDisposition', 'ContentLanguage',
+                  'Expires', 'Metadata')
+
+
+def copy_object_multipart(aws_s3_client, source_bucket, source_key, bucket_name, key, size,
+                          content_type=None, version_id=None, part_size=None, max_workers=None,
+                          copy_metadata=False):
+    """
+    Server-side copy with parallel upload_part_copy, needed above 5GB
+    copy_metadata=True takes Content-Type and the other headers from the source
+    """
+    part_size = choose_part_size(size, part_size)
+    num_parts = math.ceil(size / part_size)
+    copy_source = {'Bucket': source_bucket, 'Key': source_key}
+    if version_id:
+        copy_source['VersionId'] = version_id
+
+    if copy_metadata:
+        head = aws_s3_client.head_object(Bucket=source_bucket, Key=source_key,
+                                         **({'VersionId': version_id} if version_id else {}))
+        object_args = {name: head[name] for name in COPIED_HEADERS if head.get(name)}
+    else:
+        object_args = {'ContentType': content_type or 'application/octet-stream'}
+    mpu = aws_s3_client.create_multipart_upload(Bucket=bucket_name, Key=key, **object_args)
+    tuner = ConcurrencyTuner(max_workers)
+
+    def copy_part(part_number):
+        start = (part_number - 1) * part_size
+        end = min(start + part_size, size) - 1
+        tuner.acquire()
+        started = time.monotonic()
+        try:
+            response = aws_s3_client.upload_part_copy(
+                Bucket=bucket_name,
+                Key=key,
+                PartNumber=part_number,
+                UploadId=mpu['UploadId'],
+                CopySource=copy_source,
+                CopySourceRange=f"bytes={start}-{end}"
+            )
+        finally:
+            tuner.release(end + 1 - start, time.monotonic() - started)
+        return {'PartNumber': part_number, 'ETag': response['CopyPartResult']['ETag']}
+
+    try:
+        with ThreadPoolExecutor(max_workers=min(num_parts, tuner.maximum)) as executor:
+            parts = list(executor.map(copy_part, range(1, num_parts + 1)))
+        aws_s3_client.complete_multipart_upload(
+            Bucket=bucket_name,
+            Key=key,
+            UploadId=mpu['UploadId'],
+            MultipartUpload={'Parts': parts}
+        )
+    except Exception:
+        aws_s3_client.abort_multipart_upload(Bucket=bucket_name, Key=key, UploadId=mpu['UploadId'])
+        raise
+
+
+def server_side_copy(aws_s3_client, source_bucket, source_key, bucket_name, key, size,
+                     content_type=None, version_id=None, multipart_threshold=MULTIPART_COPY_THRESHOLD,
+                     copy_metadata=False):
+    """
+    Copy an object inside S3, switching to a multipart copy for big objects
+    copy_metadata=True keeps the source's headers instead of setting content_type
+    """
+    if size >= multipart_threshold:
+        copy_object_multipart(aws_s3_client, source_bucket, source_key, bucket_name, key, size,
+                              content_type, version_id, copy_metadata=copy_metadata)
+        return
+    copy_source = {'Bucket': source_bucket, 'Key': source_key}
+    if version_id:
+        copy_source['VersionId'] = version_id
+    if copy_metadata:
+        aws_s3_client.copy_object(Bucket=bucket_name, CopySource=copy_source, Key=key)
+        return
+    aws_s3_client.copy_object(
+        Bucket=bucket_name,
+        CopySource=copy_source,
+        Key=key,
+        MetadataDirective='REPLACE',
+        ContentType=content_type or 'application/octet-stream'
+    )
+
+
+class TransferProgress:
+    """
+    Thread-safe object/byte counter that prints throughput every few seconds
+    """
+
+    def __init__(self, label, interval=5.0):
+        self.label = label
+        self.interval = interval
+        self.objects = 0
+        self.bytes = 0
+        self._started = time.monotonic()
+        self._last_report = self._started
+        self._lock = Lock()
+
+    def add(self, nbytes):
+        with self._lock:
+            self.objects += 1
+            self.bytes += nbytes
+            now = time.monotonic()
+            if now - self._last_report >= self.interval:
+                self._last_report = now
+                print(self.summary())
+
+    def summary(self):
+        elapsed = max(time.monotonic() - self._started, 1e-6)
+        return (f"{self.label} {self.objects} objects ({self.bytes / MB:.1f} MB) "
+                f"at {self.objects / elapsed:.1f} obj/s, {self.bytes / MB / elapsed:.1f} MB/s")
+
+
+def collecting_objects(bucket_name, aws_s3_client, max_workers=16, journal_path=None, index=None):
+    """
+    Copy every object into a folder named after its extension
+
+    Copies run on a bounded worker pool while the listing streams in, big
+    objects use a multipart copy. Finished keys are appended to a journal
+    so an interrupted run continues where it stopped. With a BucketIndex
+    the work list comes from the index instead of a listing
+    """
+    if journal_path is None:
+        journal_path = f".collect-{bucket_name}.journal"
+
+    done_keys = set()
+    if os.path.exists(journal_path):
+        with open(journal_path) as journal:
+            done_keys = {json.loads(line) for line in journal if line.strip()}
+        print(f"Resuming, {len(done_keys)} objects already copied")
+
     extension_counts = defaultdict(int)
-    response = aws_s3_client.list_objects_v2(Bucket=bucket_name)
+    for file_name in done_keys:
+        extension_counts[file_name.split('.')[-1] if '.' in file_name else ''] += 1
+
+    counts_lock = Lock()
+    slots = BoundedSemaphore(2 * max_workers)
+    progress = TransferProgress("Copied")
+    failed = []
+
+    journal = open(journal_path, 'a')
+
+    def copy_one(obj, extension):
+        file_name = obj['Key']
+        try:
+            # Listings carry no headers, the copy takes them from the source
+            server_side_copy(aws_s3_client, bucket_name, file_name, bucket_name, extension + '/' + file_name,
+                             obj['Size'], copy_metadata=True)
+        except Exception as e:
+            print(f"Error copying {file_name}: {e}")
+            with counts_lock:
+                failed.append(file_name)
+            return
+        finally:
+            slots.release()
+        with counts_lock:
+            extension_counts[extension] += 1
+            journal.write(json.dumps(file_name) + '\n')
+            journal.flush()
+        progress.add(obj['Size'])
 
     try:
-        if 'Contents' in response:
-            for obj in response['Contents']:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            objects = index.iter_objects(bucket_name) if index is not None else iter_objects(aws_s3_client, bucket_name)
+            for obj in objects:
                 file_name = obj['Key']
                 extension = file_name.split('.')[-1] if '.' in file_name else ''
-                extension_counts[extension] += 1
-
-                aws_s3_client.copy_object(
-                    Bucket=bucket_name,
-                    CopySource={
-                        'Bucket': bucket_name,
-                        'Key': file_name
-                    },
-                    Key=extension + '/' + file_name,
-                    MetadataDirective='REPLACE',
-                    ContentType=obj['ContentType'] if 'ContentType' in obj else 'application/octet-stream'
-                )
+                # Copies land back in the listing, skip what is already sorted
+                if file_name.startswith(extension + '/') or file_name in done_keys:
+                    continue
+                slots.acquire()
+                executor.submit(copy_one, obj, extension)
     except ClientError as e:
         print(e)
         return False
+    finally:
+        journal.close()
+
+    print(progress.summary())
     for ext, count in extension_counts.items():
         print(f"{ext}: {count} files")
+    if failed:
+        print(f"{len(failed)} objects failed, run again to retry them")
+        return False
+    os.remove(journal_path)
     return True
 
 
 def upload_to_folder(bucket_name, file_path, aws_s3_client):
-    mime = magic.Magic(mime=True)
-    file_type = mime.from_file(file_path)
+    file_type = guess_content_type(file_path, sniff="always")
 
     main_type = file_type.split('/')[0]
     file_name = os.path.basename(file_path)
     key = f"{main_type}/{file_name}"
 
     file_size = os.path.getsize(file_path)
-    if file_size >= 100 * 1024 * 1024:  # 100MB
+    if should_use_multipart(file_size):
         typer.echo("Using multipart upload for large file...")
-        result = upload_large_file(aws_s3_client, bucket_name, file_path, key)
+        result = upload_large_file(aws_s3_client, bucket_name, file_path, key, content_type=file_type)
     else:
         typer.echo("Using simple upload for small file...")
-        result = upload_small_file(aws_s3_client, bucket_name, file_path, key)
+        result = upload_small_file(aws_s3_client, bucket_name, file_path, key, file_type)
 
     if result:
         typer.echo(f"Successfully uploaded {file_path} to {bucket_name}/{key}")
@@ -422,21 +2457,37 @@ def upload_to_folder(bucket_name, file_path, aws_s3_client):
         typer.echo("Upload failed")
 
 
-def delete_old_files(bucket_name, aws_s3_client, file_name):
-    versions = list_file_versions(aws_s3_client, bucket_name, file_name)
+def delete_old_files(bucket_name, aws_s3_client, file_name, index=None):
+    versions = list_file_versions(aws_s3_client, bucket_name, file_name, index)
     if versions:
         six_months_ago = datetime.now(versions[0]['LastModified'].tzinfo) - timedelta(days=180)
-        for version in versions:
-            if version['LastModified'] < six_months_ago:
-                try:
-                    aws_s3_client.delete_object(
-                        Bucket=bucket_name,
-                        Key=file_name,
-                        VersionId=version['VersionId']
-                    )
-                    typer.echo(f"Deleted version {version['VersionId']} of {file_name} from {bucket_name}")
-                except ClientError as e:
-                    typer.echo(f"Error deleting version {version['VersionId']}: {e}")
+        old_versions = [(file_name, version['VersionId']) for version in versions
+                        if version['LastModified'] < six_months_ago]
+        if not old_versions:
+            return
+        deleted, errors = delete_objects_batched(aws_s3_client, bucket_name, old_versions)
+        typer.echo(f"Deleted {deleted} old versions of {file_name} from {bucket_name}")
+        for error in errors:
+            typer.echo(f"Error deleting version {error.get('VersionId')}: {error['Message']}")
+        if index is not None:
+            failed = {error.get('VersionId') for error in errors}
+            index.forget(bucket_name, file_name, [v for _, v in old_versions if v not in failed])
+
+
+def configure_website(aws_s3_client, bucket_name):
+    """
+    Turn on static website hosting (index.html / error.html) with a public read policy
+    Raises ClientError
+    """
+    aws_s3_client.delete_public_access_block(Bucket=bucket_name)
+    aws_s3_client.put_bucket_website(
+        Bucket=bucket_name,
+        WebsiteConfiguration={
+            'ErrorDocument': {'Key': 'error.html'},
+            'IndexDocument': {'Suffix': 'index.html'},
+        }
+    )
+    aws_s3_client.put_bucket_policy(Bucket=bucket_name, Policy=generate_public_read_policy(bucket_name))
 
 
 def basic_file_upload(bucket_name, file_path, aws_s3_client):
@@ -454,6 +2505,8 @@ def basic_file_upload(bucket_name, file_path, aws_s3_client):
 
 
 def download_webpage_source(url: str) -> tuple[None, None] | tuple[str, str]:
+    import requests
+
     try:
         response = requests.get(url)
         response.raise_for_status()
@@ -464,3 +2517,334 @@ def download_webpage_source(url: str) -> tuple[None, None] | tuple[str, str]:
     except requests.RequestException as e:
         print(f"Error downloading webpage: {e}")
         return None, None
+
+
+def sync_manifest_path(local_dir, bucket_name, prefix):
+    """
+    Manifest location in cache_dir() for syncing local_dir to bucket_name/prefix
+    """
+    sync_id = f"{os.path.abspath(local_dir)}\ns3://{bucket_name}/{prefix}"
+    return os.path.join(cache_dir(), f"sync-{hashlib.sha256(sync_id.encode()).hexdigest()[:32]}.json")
+
+
+def sync_directory(aws_s3_client, bucket_name, local_dir, prefix="", delete=False, max_workers=SYNC_WORKERS):
+    """
+    Upload new and changed files from local_dir to bucket_name/prefix
+
+    Files are compared by size and mtime against a manifest kept in
+    cache_dir() per directory and destination, so unchanged files are not
+    hashed again and nothing is written into local_dir. Files without a
+    manifest entry are compared by ETag. With delete=True remote keys that
+    no longer exist locally are removed
+    """
+    prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+    manifest_path = sync_manifest_path(local_dir, bucket_name, prefix)
+    manifest = load_json_state(manifest_path) or {}
+
+    remote = {}
+    try:
+        for obj in iter_objects(aws_s3_client, bucket_name, prefix, parallel=True):
+            remote[obj['Key']] = (obj['Size'], obj['ETag'].strip('"'))
+    except ClientError as e:
+        print(f"Error listing bucket: {e}")
+        return False
+
+    summary = {'uploaded': 0, 'skipped': 0, 'deleted': 0, 'failed': 0}
+    to_upload = []
+    local_keys = set()
+    new_manifest = {}
+    for root, dirs, files in os.walk(local_dir):
+        for name in files:
+            file_path = os.path.join(root, name)
+            rel_path = os.path.relpath(file_path, local_dir).replace(os.sep, '/')
+            key = prefix + rel_path
+            local_keys.add(key)
+            file_stat = os.stat(file_path)
+            entry = manifest.get(rel_path)
+            remote_size, remote_etag = remote.get(key, (None, None))
+
+            unchanged = False
+            if remote_size == file_stat.st_size:
+                if (entry and entry['size'] == file_stat.st_size
+                        and entry['mtime_ns'] == file_stat.st_mtime_ns
+                        and entry['etag'] in (None, remote_etag)):
+                    unchanged = True
+                else:
+                    unchanged = etag_matches(file_path, remote_etag, file_stat.st_size)
+
+            if unchanged:
+                summary['skipped'] += 1
+                new_manifest[rel_path] = {'size': file_stat.st_size, 'mtime_ns': file_stat.st_mtime_ns,
+                                          'etag': remote_etag}
+            else:
+                to_upload.append((file_path, rel_path, key, file_stat))
+
+    def upload(item):
+        file_path, rel_path, key, file_stat = item
+        if should_use_multipart(file_stat.st_size):
+            ok = upload_large_file(aws_s3_client, bucket_name, file_path, key)
+        else:
+            ok = upload_small_file(aws_s3_client, bucket_name, file_path, key)
+        return item, ok
+
+    try:
+        if to_upload:
+            with ThreadPoolExecutor(max_workers=min(len(to_upload), max_workers)) as executor:
+                for (file_path, rel_path, key, file_stat), ok in executor.map(upload, to_upload):
+                    if ok:
+                        summary['uploaded'] += 1
+                        # The ETag is picked up from the listing on the next run
+                        new_manifest[rel_path] = {'size': file_stat.st_size,
+                                                  'mtime_ns': file_stat.st_mtime_ns, 'etag': None}
+                    else:
+                        summary['failed'] += 1
+    finally:
+        save_json_state(manifest_path, new_manifest)
+
+    if delete:
+        orphans = (key for key in remote if key not in local_keys)
+        deleted, errors = delete_objects_batched(aws_s3_client, bucket_name, orphans)
+        summary['deleted'] = deleted
+        summary['failed'] += len(errors)
+
+    return summary
+
+
+SITE_HASH_CACHE = 'site-hashes.json'
+CACHE_CONTROL = {
+    'page': 'public, max-age=0, must-revalidate',
+    'fingerprinted': 'public, max-age=31536000, immutable',
+    'asset': 'public, max-age=86400',
+}
+PAGE_TYPES = {'text/html', 'application/xhtml+xml', 'application/xml', 'text/xml', 'application/json',
+              'application/manifest+json', 'text/plain'}
+# app.3f9a2b1c.js, chunk-5FJ2KX7Q.css, logo.d41d8cd98f00.svg: a hex or base32-style
+# hash segment of 8+ characters mixing letters and digits right before the extension
+FINGERPRINT = re.compile(r'[.-](?=[0-9a-zA-Z]*[0-9])(?=[0-9a-zA-Z]*[a-zA-Z])([0-9a-f]{8,}|[0-9A-Z]{8,})\.[0-9a-z]+$')
+
+
+def cache_control_for(rel_path, content_type):
+    """
+    Cache-Control for a site file: pages revalidate, fingerprinted assets
+    are immutable and other assets are cached for a day
+    """
+    content_type = (content_type or '').split(';')[0]
+    if content_type in PAGE_TYPES:
+        return CACHE_CONTROL['page']
+    name = rel_path.rsplit('/', 1)[-1]
+    if FINGERPRINT.search(name):
+        return CACHE_CONTROL['fingerprinted']
+    return CACHE_CONTROL['asset']
+
+
+def _stream_etag(stream, part_size=DEFAULT_PART_SIZE):
+    # The ETag upload_stream produces for these bytes
+    digests = []
+    first_size = None
+    for chunk in iter(lambda: _read_exactly(stream, part_size), b''):
+        digests.append(hashlib.md5(chunk, usedforsecurity=False))
+        if first_size is None:
+            first_size = len(chunk)
+    if not digests:
+        return hashlib.md5(b'', usedforsecurity=False).hexdigest()
+    if first_size < part_size:
+        return digests[0].hexdigest()
+    return _composite_etag([digest.hexdigest() for digest in digests])
+
+
+def _site_body(file_path, compress):
+    return GzipReader(file_path) if compress else open(file_path, 'rb')
+
+
+def deploy_site(aws_s3_client, bucket_name, site_dir, prefix="", prune=True, compress=False,
+                max_workers=32):
+    """
+    Publish a static site directory, uploading only files that changed
+
+    Each file's ETag is computed the way upload_stream will produce it
+    (from the gzip bytes with compress=True) and compared with the remote
+    listing; hashes are cached by size and mtime so unchanged files are not
+    read again. Assets are uploaded before pages so a new page never links
+    to a missing asset, then keys that no longer exist locally are deleted
+    in batches (prune=False keeps them)
+    """
+    prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+    hash_cache_path = os.path.join(cache_dir(), SITE_HASH_CACHE)
+    hash_cache = load_json_state(hash_cache_path) or {}
+
+    remote = {}
+    try:
+        for obj in iter_objects(aws_s3_client, bucket_name, prefix, parallel=True):
+            remote[obj['Key']] = obj['ETag'].strip('"')
+    except ClientError as e:
+        print(f"Error listing bucket: {e}")
+        return False
+
+    def plan(item):
+        file_path, key = item
+        file_stat = os.stat(file_path)
+        content_type = guess_content_type(file_path, sniff="fallback") or 'application/octet-stream'
+        cache_key = os.path.abspath(file_path)
+        entry = hash_cache.get(cache_key)
+        if not (entry and entry['size'] == file_stat.st_size and entry['mtime_ns'] == file_stat.st_mtime_ns
+                and entry['compress'] == compress):
+            gzip_it = compress and is_compressible(content_type) and compression_ratio(file_path) <= 0.9
+            with _site_body(file_path, gzip_it) as body:
+                etag = _stream_etag(body)
+            entry = {'size': file_stat.st_size, 'mtime_ns': file_stat.st_mtime_ns, 'compress': compress,
+                     'gzip': gzip_it, 'etag': etag}
+        return file_path, key, content_type, cache_key, entry
+
+    summary = {'uploaded': 0, 'unchanged': 0, 'deleted': 0, 'failed': 0}
+    local_keys = set()
+    pending = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for file_path, key, content_type, cache_key, entry in executor.map(plan, iter_upload_sources(site_dir, prefix)):
+            local_keys.add(key)
+            hash_cache[cache_key] = entry
+            if remote.get(key) == entry['etag']:
+                summary['unchanged'] += 1
+            else:
+                pending.append((file_path, key, content_type, entry))
+
+    def upload(item):
+        file_path, key, content_type, entry = item
+        with _site_body(file_path, entry['gzip']) as body:
+            return upload_stream(aws_s3_client, bucket_name, key, body, content_type,
+                                 content_encoding='gzip' if entry['gzip'] else None,
+                                 cache_control=cache_control_for(key, content_type))
+
+    try:
+        pages = [item for item in pending if cache_control_for(item[1], item[2]) == CACHE_CONTROL['page']]
+        assets = [item for item in pending if cache_control_for(item[1], item[2]) != CACHE_CONTROL['page']]
+        for batch in (assets, pages):
+            if not batch:
+                continue
+            with ThreadPoolExecutor(max_workers=min(len(batch), max_workers)) as executor:
+                for ok in executor.map(upload, batch):
+                    summary['uploaded' if ok else 'failed'] += 1
+    finally:
+        save_json_state(hash_cache_path, hash_cache)
+
+    # Keep the old files around if the new version is not fully there
+    if prune and not summary['failed']:
+        stale = (key for key in remote if key not in local_keys)
+        deleted, errors = delete_objects_batched(aws_s3_client, bucket_name, stale)
+        summary['deleted'] = deleted
+        summary['failed'] += len(errors)
+
+    return summary
+
+
+def call_with_retries(function, attempts=3, base_delay=0.2, max_delay=5.0):
+    """
+    Call function(), retrying failures with jittered exponential backoff
+    Returns (result, attempts used); the last error is raised
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return function(), attempt
+        except PartCancelled:
+            raise
+        except Exception:
+            if attempt == attempts:
+                raise
+            time.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1))))
+
+
+def iter_upload_sources(source, prefix=""):
+    """
+    Yield (file_path, key) for a directory tree, or for a file listing one
+    path per line ("-" reads the list from stdin)
+    """
+    import sys
+
+    prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            for name in files:
+                file_path = os.path.join(root, name)
+                yield file_path, prefix + os.path.relpath(file_path, source).replace(os.sep, '/')
+        return
+    listing = sys.stdin if source == '-' else open(source)
+    with listing:
+        for line in listing:
+            file_path = line.strip()
+            if file_path:
+                key = os.path.normpath(file_path).replace(os.sep, '/').lstrip('/')
+                yield file_path, prefix + key
+
+
+def upload_many(aws_s3_client, bucket_name, sources, max_workers=32, readers=4, read_ahead=128,
+                retries=3, log_path=None):
+    """
+    Upload many small files with put_object on a bounded thread pool
+
+    Reader threads load the next files while sender threads are on the
+    network; at most read_ahead files are held in memory. Each put is
+    retried with backoff, files above the multipart threshold go through
+    upload_large_file. Results are appended to log_path as NDJSON
+    """
+    summary = {'uploaded': 0, 'failed': 0, 'bytes': 0}
+    lock = Lock()
+    slots = BoundedSemaphore(read_ahead)
+    log = open(log_path, 'a') if log_path else None
+
+    def record(result):
+        with lock:
+            if result['status'] == 'ok':
+                summary['uploaded'] += 1
+                summary['bytes'] += result['bytes']
+            else:
+                summary['failed'] += 1
+            if log is not None:
+                log.write(json.dumps(result) + '\n')
+                log.flush()
+
+    def send(file_path, key, body, content_type, started):
+        result = {'path': file_path, 'key': key, 'bytes': len(body)}
+        try:
+            _, result['attempts'] = call_with_retries(lambda: aws_s3_client.put_object(
+                Bucket=bucket_name, Key=key, Body=body, ContentType=content_type), retries)
+            result['status'] = 'ok'
+        except Exception as e:
+            result['status'] = 'error'
+            result['error'] = str(e)
+        finally:
+            slots.release()
+        result['latency'] = round(time.monotonic() - started, 4)
+        record(result)
+
+    def read(file_path, key):
+        started = time.monotonic()
+        # The slot is handed to send() once the body is queued, every other path gives it back here
+        handed_off = False
+        try:
+            content_type = guess_content_type(file_path, sniff="fallback") or 'application/octet-stream'
+            size = os.path.getsize(file_path)
+            if should_use_multipart(size):
+                ok = upload_large_file(aws_s3_client, bucket_name, file_path, key, content_type=content_type)
+                record({'path': file_path, 'key': key, 'bytes': size, 'status': 'ok' if ok else 'error',
+                        'latency': round(time.monotonic() - started, 4)})
+                return
+            with open(file_path, 'rb') as f:
+                body = f.read()
+            senders.submit(send, file_path, key, body, content_type, started)
+            handed_off = True
+        except Exception as e:
+            record({'path': file_path, 'key': key, 'bytes': 0, 'status': 'error', 'error': str(e),
+                    'latency': round(time.monotonic() - started, 4)})
+        finally:
+            if not handed_off:
+                slots.release()
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as senders:
+            with ThreadPoolExecutor(max_workers=readers) as reader_pool:
+                for file_path, key in sources:
+                    slots.acquire()
+                    reader_pool.submit(read, file_path, key)
+    finally:
+        if log is not None:
+            log.close()
+    return summary
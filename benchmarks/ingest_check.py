@@ -0,0 +1,170 @@
+"""
+End-to-end check for ingest_urls against local stand-ins
+
+Serves generated bodies from a local http.server and ingests them into a
+moto server (or --endpoint-url), then checks the objects, the NDJSON report
+(status, bytes, latency and error rows), the per-host connection limit and
+that a re-run only fetches what is missing or failed:
+
+    python benchmarks/ingest_check.py
+
+Works fully offline. Requires moto[server] for the built-in stand-in.
+Exits 1 when a check fails.
+"""
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from s3_workloads import MB, moto_server, s3_cli  # noqa: E402
+
+PER_HOST = 3
+# path -> body size; sizes above the part size go through a multipart upload
+BODIES = {f"/files/small-{i}.txt": 1000 + i for i in range(20)}
+BODIES["/files/large.bin"] = 12 * MB
+BODIES["/files/empty.txt"] = 0
+
+
+def body(path):
+    size = BODIES[path]
+    return (path.encode() * (size // len(path) + 1))[:size]
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """
+    /files/* returns a generated body, /missing is a 404 and /flaky fails
+    with a 500 on its first request only. Requests and concurrency are counted
+    """
+
+    lock = threading.Lock()
+    requests = {}
+    active = 0
+    max_active = 0
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.requests[self.path] = cls.requests.get(self.path, 0) + 1
+            first = cls.requests[self.path] == 1
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+        try:
+            # Keep requests overlapping so the per-host limit is exercised
+            time.sleep(0.05)
+            if self.path in BODIES:
+                data = body(self.path)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            elif self.path == "/flaky" and not first:
+                self.send_response(200)
+                self.send_header("Content-Length", "5")
+                self.end_headers()
+                self.wfile.write(b"flaky")
+            else:
+                self.send_error(500 if self.path == "/flaky" else 404)
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@contextlib.contextmanager
+def http_stand_in():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def read_report(report_path):
+    with open(report_path) as report:
+        return [json.loads(line) for line in report if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoint-url", help="Use this S3-compatible server instead of starting moto")
+    args = parser.parse_args()
+
+    os.environ.setdefault("aws_access_key_id", "benchmark")
+    os.environ.setdefault("aws_secret_access_key", "benchmark")
+    os.environ.setdefault("aws_region_name", "us-east-1")
+
+    failures = []
+
+    def check(ok, message):
+        print(f"{'ok  ' if ok else 'FAIL'} {message}", file=sys.stderr)
+        if not ok:
+            failures.append(message)
+
+    with contextlib.ExitStack() as stack:
+        endpoint_url = args.endpoint_url or stack.enter_context(moto_server())
+        os.environ["aws_endpoint_url"] = endpoint_url
+        base_url = stack.enter_context(http_stand_in())
+        workdir = tempfile.mkdtemp(prefix="s3-ingest-")
+        stack.callback(shutil.rmtree, workdir, ignore_errors=True)
+        client = s3_cli.init_client(32)
+        bucket_name = "ingest-check"
+        s3_cli.create_bucket(client, bucket_name)
+
+        report_path = os.path.join(workdir, "report.ndjson")
+        entries = [(base_url + path, path.rsplit("/", 1)[-1]) for path in BODIES]
+        entries += [(base_url + "/missing", "missing.txt"), (base_url + "/flaky", "flaky.txt")]
+
+        def ingest():
+            return s3_cli.ingest_urls(client, bucket_name, entries, report_path, max_workers=8,
+                                      per_host=PER_HOST, upload_workers=8, part_size=5 * MB)
+
+        summary = ingest()
+        check(summary == {"ok": len(BODIES), "failed": 2, "skipped": 0}, f"first run summary {summary}")
+        check(StandIn.max_active <= PER_HOST,
+              f"at most {PER_HOST} requests per host at once (saw {StandIn.max_active})")
+
+        rows = {row["key"]: row for row in read_report(report_path)}
+        check(all({"status", "bytes", "latency"} <= set(row) for row in rows.values()),
+              "every report row has status, bytes and latency")
+        check(rows["missing.txt"]["status"] == "error" and rows["missing.txt"].get("http_status") == 404,
+              "404 is reported as an error row")
+        check(rows["flaky.txt"]["status"] == "error" and rows["flaky.txt"].get("http_status") == 500,
+              "500 is reported as an error row")
+        check(all(rows[path.rsplit("/", 1)[-1]]["bytes"] == size for path, size in BODIES.items()),
+              "report bytes match the bodies")
+
+        mismatched = [path for path in BODIES
+                      if client.get_object(Bucket=bucket_name, Key=path.rsplit("/", 1)[-1])["Body"].read()
+                      != body(path)]
+        check(not mismatched, f"stored objects match the served bodies {mismatched or ''}")
+
+        fetched_before = dict(StandIn.requests)
+        summary = ingest()
+        check(summary == {"ok": 1, "failed": 1, "skipped": len(BODIES)}, f"re-run summary {summary}")
+        refetched = sorted(path for path, count in StandIn.requests.items() if count != fetched_before.get(path))
+        check(refetched == ["/flaky", "/missing"], f"re-run only fetches failed keys {refetched}")
+        check(client.get_object(Bucket=bucket_name, Key="flaky.txt")["Body"].read() == b"flaky",
+              "failed key is ingested on re-run")
+
+    if failures:
+        print(f"{len(failures)} checks failed", file=sys.stderr)
+        sys.exit(1)
+    print("All ingest checks passed", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
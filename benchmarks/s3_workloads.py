@@ -0,0 +1,263 @@
+"""
+Benchmark suite for the transfer paths in app/s3_cli.py
+
+Starts a local S3 stand-in (moto server, in its own process) unless
+--endpoint-url points at another S3-compatible server, runs each workload
+and writes the results as JSON so runs can be compared:
+
+    python benchmarks/s3_workloads.py --output after.json --compare before.json
+    python benchmarks/s3_workloads.py --quick --only small_upload,listing
+
+Works fully offline. Requires moto[server] for the built-in stand-in.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app import s3_cli  # noqa: E402
+
+MB = s3_cli.MB
+
+
+@contextlib.contextmanager
+def moto_server():
+    """
+    Run moto server on a free local port, yields its endpoint URL
+    """
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    process = subprocess.Popen([sys.executable, "-m", "moto.server", "-H", "127.0.0.1", "-p", str(port)],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline or process.poll() is not None:
+                    raise RuntimeError("moto server did not start, is moto[server] installed?")
+                time.sleep(0.1)
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def fresh_bucket(client, name):
+    s3_cli.create_bucket(client, name)
+    return name
+
+
+def put_many(client, bucket_name, keys, body=b"", workers=32):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda key: client.put_object(Bucket=bucket_name, Key=key, Body=body), keys))
+
+
+class WorkloadFailed(Exception):
+    pass
+
+
+def require(ok, message):
+    # A path that fails fast must not be reported as a fast one
+    if not ok:
+        raise WorkloadFailed(message)
+
+
+def measure(function):
+    started = time.perf_counter()
+    function()
+    return time.perf_counter() - started
+
+
+def result(ops, nbytes, seconds):
+    return {
+        "ops": ops,
+        "bytes": nbytes,
+        "seconds": round(seconds, 4),
+        "ops_per_s": round(ops / seconds, 2),
+        "mb_per_s": round(nbytes / MB / seconds, 2),
+    }
+
+
+def small_upload(client, workdir, params):
+    """upload_small_file over many small files"""
+    bucket_name = fresh_bucket(client, "bench-small")
+    count, size = params["small_files"], params["small_size"]
+    paths = []
+    for i in range(count):
+        path = os.path.join(workdir, f"small-{i}.bin")
+        with open(path, "wb") as f:
+            f.write(os.urandom(size))
+        paths.append(path)
+
+    def run():
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            results = list(executor.map(lambda p: s3_cli.upload_small_file(client, bucket_name, p), paths))
+        require(all(results), f"{results.count(False)} of {count} small uploads failed")
+
+    return result(count, count * size, measure(run))
+
+
+def large_upload(client, workdir, params):
+    """upload_large_file multipart throughput"""
+    bucket_name = fresh_bucket(client, "bench-large")
+    size = params["large_size"]
+    path = os.path.join(workdir, "large.bin")
+    with open(path, "wb") as f:
+        block = os.urandom(MB)
+        for _ in range(size // MB):
+            f.write(block)
+    seconds = measure(lambda: require(s3_cli.upload_large_file(client, bucket_name, path),
+                                      "multipart upload failed"))
+    return result(1, size, seconds)
+
+
+def listing(client, workdir, params):
+    """iter_objects rate, serial and with prefix fan-out"""
+    bucket_name = fresh_bucket(client, "bench-list")
+    count = params["list_keys"]
+    put_many(client, bucket_name, [f"d{i % 16:02d}/k{i:08d}" for i in range(count)])
+    serial = measure(lambda: sum(1 for _ in s3_cli.iter_objects(client, bucket_name)))
+    parallel = measure(lambda: sum(1 for _ in s3_cli.iter_objects(client, bucket_name, parallel=True)))
+    return {"serial": result(count, 0, serial), "parallel": result(count, 0, parallel)}
+
+
+def server_side_copy(client, workdir, params):
+    """collecting_objects server-side copy rate"""
+    bucket_name = fresh_bucket(client, "bench-copy")
+    count = params["copy_objects"]
+    put_many(client, bucket_name, [f"k{i:08d}.txt" for i in range(count)], body=b"x" * 1024)
+    journal = os.path.join(workdir, "collect.journal")
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        seconds = measure(lambda: require(s3_cli.collecting_objects(bucket_name, client, journal_path=journal),
+                                          "collecting_objects failed"))
+    return result(count, count * 1024, seconds)
+
+
+def version_cleanup(client, workdir, params):
+    """list the versions of a key and batch-delete all but the latest"""
+    bucket_name = fresh_bucket(client, "bench-versions")
+    client.put_bucket_versioning(Bucket=bucket_name, VersioningConfiguration={"Status": "Enabled"})
+    count = params["versions"]
+    for _ in range(count):
+        client.put_object(Bucket=bucket_name, Key="versioned.txt", Body=b"v")
+
+    def run():
+        versions = s3_cli.list_file_versions(client, bucket_name, "versioned.txt")
+        old = [("versioned.txt", v["VersionId"]) for v in versions if not v["IsLatest"]]
+        deleted, errors = s3_cli.delete_objects_batched(client, bucket_name, old)
+        require(not errors and deleted == count - 1, f"deleted {deleted} of {count - 1} old versions")
+
+    return result(count - 1, 0, measure(run))
+
+
+WORKLOADS = {
+    "small_upload": small_upload,
+    "large_upload": large_upload,
+    "listing": listing,
+    "server_side_copy": server_side_copy,
+    "version_cleanup": version_cleanup,
+}
+
+FULL = {"small_files": 2000, "small_size": 16 * 1024, "large_size": 512 * MB,
+        "list_keys": 100000, "copy_objects": 5000, "versions": 5000}
+QUICK = {"small_files": 200, "small_size": 16 * 1024, "large_size": 128 * MB,
+         "list_keys": 5000, "copy_objects": 500, "versions": 500}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def headline(value):
+    # Nested workloads (listing) are compared on their first entry
+    while "ops_per_s" not in value:
+        value = next(iter(value.values()))
+    return value
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)["workloads"]
+    print(f"\n{'workload':<20}{'baseline ops/s':>16}{'current ops/s':>16}{'change':>10}")
+    for name, value in results.items():
+        if name not in baseline or "error" in value or "error" in baseline[name]:
+            continue
+        before, after = headline(baseline[name])["ops_per_s"], headline(value)["ops_per_s"]
+        print(f"{name:<20}{before:>16.1f}{after:>16.1f}{(after / before - 1) * 100:>9.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoint-url", help="Use this S3-compatible server instead of starting moto")
+    parser.add_argument("--quick", action="store_true", help="Smaller workloads for a fast check")
+    parser.add_argument("--only", help="Comma separated workloads to run: " + ", ".join(WORKLOADS))
+    parser.add_argument("--output", default="bench_results.json", help="JSON results file")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    params = QUICK if args.quick else FULL
+    selected = args.only.split(",") if args.only else list(WORKLOADS)
+
+    os.environ.setdefault("aws_access_key_id", "benchmark")
+    os.environ.setdefault("aws_secret_access_key", "benchmark")
+    os.environ.setdefault("aws_region_name", "us-east-1")
+
+    with contextlib.ExitStack() as stack:
+        endpoint_url = args.endpoint_url or stack.enter_context(moto_server())
+        os.environ["aws_endpoint_url"] = endpoint_url
+        workdir = tempfile.mkdtemp(prefix="s3-bench-")
+        stack.callback(shutil.rmtree, workdir, ignore_errors=True)
+        client = s3_cli.init_client(64)
+
+        results = {}
+        failed = []
+        for name in selected:
+            print(f"Running {name}...", file=sys.stderr)
+            try:
+                results[name] = WORKLOADS[name](client, workdir, params)
+            except WorkloadFailed as e:
+                results[name] = {"error": str(e)}
+                failed.append(name)
+            print(f"  {json.dumps(results[name])}", file=sys.stderr)
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "endpoint": args.endpoint_url or "moto",
+        "params": params,
+        "workloads": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+    if args.compare:
+        compare(results, args.compare)
+    if failed:
+        print(f"Failed workloads: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Startup benchmark for main.py
+
+Measures the cold import time of main.py with python -X importtime and
+the wall-clock time of `list-commands` and `--help`, and fails (exit 1)
+when the import goes over the budget or a heavy dependency is imported
+before a command needs it.
+
+    python benchmarks/startup.py --budget-ms 150
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only commands that talk to S3 or the web may pull these in
+HEAVY_MODULES = ["boto3", "botocore.client", "botocore.config", "requests", "magic", "dotenv", "sqlite3"]
+
+
+def import_time_us():
+    """
+    Cumulative import time of main.py in a fresh interpreter, in microseconds
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    for line in result.stderr.splitlines():
+        fields = [field.strip() for field in line.split("|")]
+        if len(fields) == 3 and fields[2] == "main":
+            return int(fields[1])
+    raise RuntimeError("main not found in -X importtime output")
+
+
+def heavy_imports():
+    code = ("import json, sys, main; "
+            f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))")
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout)
+
+
+def command_time_ms(args, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "main.py", *args], cwd=ROOT, capture_output=True, check=True)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_MS", 150)),
+                        help="Maximum cumulative import time of main.py")
+    parser.add_argument("--runs", type=int, default=5, help="Runs per measurement, the median is reported")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    # Measure an installed CLI, not the one-off cost of compiling bytecode
+    subprocess.run([sys.executable, "-m", "compileall", "-q", "main.py", "app"], cwd=ROOT, check=True)
+
+    results = {
+        "import_ms": statistics.median(import_time_us() for _ in range(args.runs)) / 1000,
+        "list_commands_ms": command_time_ms(["list-commands"], args.runs),
+        "help_ms": command_time_ms(["--help"], args.runs),
+        "heavy_imports": heavy_imports(),
+        "budget_ms": args.budget_ms,
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    failures = []
+    if results["import_ms"] > args.budget_ms:
+        failures.append(f"import main took {results['import_ms']:.1f}ms, budget {args.budget_ms:.0f}ms")
+    if results["heavy_imports"]:
+        failures.append(f"imported at startup: {', '.join(results['heavy_imports'])}")
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
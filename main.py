@@ -1,8 +1,20 @@
 import json
 import os
+import sys
 from typing import Optional
 
-import requests
+# batch-cmd and anything reading stdin ("-") need this process's stdin, so they run locally
+if (__name__ == "__main__" and os.getenv("aws_s3_cli_socket")
+        and sys.argv[1:2] not in (["serve-cmd"], ["batch-cmd"]) and "-" not in sys.argv[1:]):
+    # Thin invocation: hand the command line to a warm daemon if one is up
+    from app.daemon import forward_command
+
+    exit_code = forward_command(os.getenv("aws_s3_cli_socket"), sys.argv[1:])
+    if exit_code is not None:
+        sys.exit(exit_code)
+
+import shlex
+
 import typer
 from botocore.exceptions import ClientError
 
@@ -10,13 +22,45 @@ from app.s3_cli import (
     init_client, list_buckets, create_bucket, delete_bucket,
     bucket_exists, download_file_and_upload_to_s3,
     set_object_access_policy, create_bucket_policy,
-    read_bucket_policy, generate_public_read_policy, validate_mime_type, upload_large_file, upload_small_file,
+    read_bucket_policy, validate_mime_type, guess_content_type, upload_large_file, upload_small_file,
     set_lifecycle_policy, delete_file, get_bucket_versioning, list_file_versions, restore_file_version,
-    collecting_objects, upload_to_folder, delete_old_files, basic_file_upload, download_webpage_source
+    collecting_objects, upload_to_folder, delete_old_files, download_webpage_source, configure_website, deploy_site,
+    parse_size, parse_concurrency, should_use_multipart, download_large_file, sync_directory,
+    iter_objects, delete_objects_batched, purge_prefix, VersionIndex,
+    ingest_urls, read_url_manifest, MAX_CONCURRENCY, SYNC_WORKERS, HEDGE_WORKERS, enable_metrics,
+    upload_many, iter_upload_sources, BucketIndex, set_rate_limit, parse_timestamp, restore_prefix
 )
 
 app = typer.Typer()
 
+# Commands run by batch-cmd keep the limits of the batch unless they set their own
+_batch_depth = 0
+
+
+@app.callback()
+def main(ctx: typer.Context,
+         metrics: Optional[str] = typer.Option(None, help="Write per-request S3 metrics to this JSON file"),
+         stats: bool = typer.Option(False, "--stats", help="Print a per-request S3 summary table"),
+         max_bandwidth: Optional[str] = typer.Option(None, help="Cap S3 traffic in bytes/s (e.g. 50MB)"),
+         max_rps: Optional[float] = typer.Option(None, help="Cap S3 requests per second, backs off on SlowDown")):
+    try:
+        if max_bandwidth or max_rps or not _batch_depth:
+            set_rate_limit(parse_size(max_bandwidth) if max_bandwidth else None, max_rps)
+    except ValueError as e:
+        typer.echo(f"Error: {e}")
+        raise typer.Exit(1)
+    if not metrics and not stats:
+        return
+    collector = enable_metrics()
+
+    def report():
+        if metrics:
+            with open(metrics, "w") as f:
+                json.dump(collector.snapshot(), f, indent=2)
+        typer.echo(collector.summary_table(), err=True)
+
+    ctx.call_on_close(report)
+
 
 @app.command()
 def list_commands():
@@ -33,7 +77,20 @@ def list_commands():
         "list-commands           - Show this list of commands",
         "get-bucket-versioning-cmd    - Check if bucket versioning is enabled",
         "list-file-versions-cmd      - List all versions of a specific file",
-        "restore-version-cmd         - Restore a previous version as the lates"
+        "restore-version-cmd         - Restore a previous version as the lates",
+        "upload-file-cmd             - Upload a file, multipart for large files",
+        "download-file-cmd           - Download an object with parallel ranged GETs",
+        "sync-cmd                    - Upload new and changed files from a directory",
+        "list-objects-cmd            - Stream the objects under a prefix as NDJSON",
+        "purge-prefix-cmd            - Delete every object under a prefix in batches",
+        "ingest-urls-cmd             - Fetch a manifest of URLs into a bucket",
+        "batch-cmd                   - Run many commands from a file or stdin in one process",
+        "serve-cmd                   - Serve commands from a warm process on a Unix socket",
+        "upload-many-cmd             - Upload many small files concurrently",
+        "index-bucket-cmd            - Build a local SQLite inventory of a bucket",
+        "query-index-cmd             - Query the local bucket inventory",
+        "deploy-site-cmd             - Publish a static site, uploading only changed files",
+        "restore-prefix-cmd          - Restore a prefix to how it was at a point in time"
     ]
 
     typer.echo("Available commands:")
@@ -80,6 +137,24 @@ def download_file_and_upload_to_s3_cmd(bucket_name: str, url: str, file_name: st
     typer.echo(f"File URL: {result}")
 
 
+@app.command()
+def ingest_urls_cmd(manifest: str, bucket_name: str,
+                    report: str = typer.Option("ingest-report.ndjson", help="NDJSON result log"),
+                    workers: int = typer.Option(16, help="Concurrent fetches"),
+                    per_host: int = typer.Option(4, help="Concurrent fetches per host"),
+                    upload_workers: int = typer.Option(16, help="Shared part upload threads")):
+    """
+    Fetch every "URL [KEY]" line of MANIFEST and stream it into the bucket
+    """
+    client = init_client(upload_workers + workers)
+    summary = ingest_urls(client, bucket_name, read_url_manifest(manifest), report,
+                          max_workers=workers, per_host=per_host, upload_workers=upload_workers)
+    typer.echo(f"Ingested: {summary['ok']}, failed: {summary['failed']}, "
+               f"already done: {summary['skipped']} (report: {report})")
+    if summary['failed']:
+        raise typer.Exit(1)
+
+
 @app.command()
 def set_object_access_policy_cmd(bucket_name: str, file_name: str):
     client = init_client()
@@ -106,24 +181,106 @@ def read_bucket_policy_cmd(bucket_name: str):
 
 
 @app.command()
-def upload_file_cmd(bucket_name: str, file_path: str, key: str = None, validate_mime: bool = False):
-    client = init_client()
+def upload_file_cmd(bucket_name: str, file_path: str, key: str = None, validate_mime: bool = False,
+                    resume: bool = typer.Option(False, "--resume",
+                                                help="Keep a local checkpoint and only send missing parts"),
+                    part_size: str = typer.Option("auto", help="Multipart part size (auto or e.g. 64MB)"),
+                    concurrency: str = typer.Option("auto", help="Parallel parts (auto or a number)"),
+                    compress: bool = typer.Option(False, "--compress",
+                                                  help="Gzip text-like files (Content-Encoding: gzip)"),
+                    hedge: Optional[float] = typer.Option(None, help="Resend parts slower than this percentile "
+                                                                     "of the finished ones (e.g. 0.95)")):
+    try:
+        part_size_bytes = parse_size(part_size)
+        workers = parse_concurrency(concurrency)
+    except ValueError as e:
+        typer.echo(f"Error: {e}")
+        raise typer.Exit(1)
 
-    if validate_mime and not validate_mime_type(file_path):
+    # Hedged parts run on their own threads next to the regular ones
+    client = init_client((workers or MAX_CONCURRENCY) + (HEDGE_WORKERS if hedge else 0))
+
+    # Classified once for both the check and the upload
+    content_type = guess_content_type(file_path)
+    if validate_mime and not validate_mime_type(file_path, content_type=content_type):
         typer.echo("Error: Invalid file type")
         return
+    content_type = content_type or 'application/octet-stream'
 
     file_size = os.path.getsize(file_path)
-    if file_size >= 100 * 1024 * 1024:  # 100MB
+    if should_use_multipart(file_size, part_size_bytes):
         typer.echo("Using multipart upload for large file...")
-        result = upload_large_file(client, bucket_name, file_path, key)
+        result = upload_large_file(client, bucket_name, file_path, key, part_size=part_size_bytes,
+                                   resume=resume, max_workers=workers, content_type=content_type,
+                                   compress=compress, hedge_percentile=hedge)
     else:
         typer.echo("Using simple upload for small file...")
-        result = upload_small_file(client, bucket_name, file_path, key)
+        result = upload_small_file(client, bucket_name, file_path, key, content_type, compress)
 
     typer.echo(f"Upload {'successful' if result else 'failed'}")
 
 
+@app.command()
+def download_file_cmd(bucket_name: str, key: str, file_path: Optional[str] = typer.Argument(None),
+                      part_size: str = typer.Option("auto", help="Range size (auto or e.g. 64MB)"),
+                      concurrency: str = typer.Option("auto", help="Parallel ranges (auto or a number)")):
+    try:
+        part_size_bytes = parse_size(part_size)
+        workers = parse_concurrency(concurrency)
+    except ValueError as e:
+        typer.echo(f"Error: {e}")
+        raise typer.Exit(1)
+
+    client = init_client(workers or MAX_CONCURRENCY)
+    result = download_large_file(client, bucket_name, key, file_path,
+                                 part_size=part_size_bytes, max_workers=workers)
+    typer.echo(f"Download {'successful' if result else 'failed'}")
+    if not result:
+        raise typer.Exit(1)
+
+
+@app.command()
+def sync_cmd(local_dir: str, bucket_name: str, prefix: str = "",
+             delete: bool = typer.Option(False, "--delete", help="Remove remote files missing locally")):
+    if not os.path.isdir(local_dir):
+        typer.echo(f"Error: {local_dir} is not a directory")
+        raise typer.Exit(1)
+
+    client = init_client(SYNC_WORKERS * MAX_CONCURRENCY)
+    summary = sync_directory(client, bucket_name, local_dir, prefix, delete)
+    if not summary:
+        typer.echo("Sync failed")
+        raise typer.Exit(1)
+
+    typer.echo(f"Uploaded: {summary['uploaded']}, unchanged: {summary['skipped']}, "
+               f"deleted: {summary['deleted']}, failed: {summary['failed']}")
+    if summary['failed']:
+        raise typer.Exit(1)
+
+
+@app.command()
+def upload_many_cmd(bucket_name: str,
+                    source: str = typer.Argument(..., help="Directory, or file with one path per line (- for stdin)"),
+                    prefix: str = "",
+                    workers: int = typer.Option(32, help="Parallel put_object calls"),
+                    retries: int = typer.Option(3, help="Attempts per file"),
+                    log: Optional[str] = typer.Option(None, help="Append per-file results to this NDJSON file")):
+    """
+    Upload many small files concurrently
+    """
+    if source != "-" and not os.path.exists(source):
+        typer.echo(f"Error: {source} does not exist")
+        raise typer.Exit(1)
+
+    client = init_client(workers + 1)
+    summary = upload_many(client, bucket_name, iter_upload_sources(source, prefix),
+                          max_workers=workers, retries=retries, log_path=log)
+    typer.echo(f"Uploaded: {summary['uploaded']} ({summary['bytes'] / (1024 * 1024):.1f} MB), "
+               f"failed: {summary['failed']}")
+    if summary['failed']:
+        raise typer.Exit(1)
+
+
 @app.command()
 def set_lifecycle_cmd(bucket_name: str, prefix: str = "", days: int = 120):
     client = init_client()
@@ -132,13 +289,30 @@ def set_lifecycle_cmd(bucket_name: str, prefix: str = "", days: int = 120):
 
 
 @app.command()
-def delete_file_cmd(bucket_name: str, file_key: str,
-                    delete: bool = typer.Option(False, "--del", help="Flag to confirm deletion")):
+def delete_file_cmd(bucket_name: str, file_key: Optional[str] = typer.Argument(None),
+                    delete: bool = typer.Option(False, "--del", help="Flag to confirm deletion"),
+                    from_file: Optional[str] = typer.Option(None, help="File with one key per line, - for stdin")):
     if not delete:
         typer.echo("Please provide --del flag to confirm deletion")
         raise typer.Exit(1)
 
+    if (file_key is None) == (from_file is None):
+        typer.echo("Please provide either a FILE_KEY or --from-file")
+        raise typer.Exit(1)
+
     client = init_client()
+    if from_file:
+        source = sys.stdin if from_file == "-" else open(from_file)
+        with source:
+            keys = (line.strip() for line in source if line.strip())
+            deleted, errors = delete_objects_batched(client, bucket_name, keys)
+        for error in errors:
+            typer.echo(f"Failed to delete {error['Key']}: {error['Message']}")
+        typer.echo(f"Deleted {deleted} objects from {bucket_name}")
+        if errors:
+            raise typer.Exit(1)
+        return
+
     if delete_file(client, bucket_name, file_key):
         typer.echo(f"Successfully deleted {file_key} from {bucket_name}")
     else:
@@ -146,6 +320,33 @@ def delete_file_cmd(bucket_name: str, file_key: str,
         raise typer.Exit(1)
 
 
+@app.command()
+def purge_prefix_cmd(bucket_name: str, prefix: str,
+                     delete: bool = typer.Option(False, "--del", help="Flag to confirm deletion"),
+                     all_versions: bool = typer.Option(False, "--all-versions",
+                                                       help="Also delete old versions and delete markers"),
+                     workers: int = typer.Option(4, help="DeleteObjects batches in flight"),
+                     from_index: bool = typer.Option(False, "--from-index",
+                                                     help="Take the key list from index-bucket-cmd")):
+    if not delete:
+        typer.echo("Please provide --del flag to confirm deletion")
+        raise typer.Exit(1)
+
+    client = init_client(workers + 1)
+    try:
+        deleted, errors = purge_prefix(client, bucket_name, prefix, all_versions, workers,
+                                       BucketIndex() if from_index else None)
+    except ClientError as e:
+        typer.echo(f"Error listing objects: {e}")
+        raise typer.Exit(1)
+
+    for error in errors:
+        typer.echo(f"Failed to delete {error['Key']}: {error['Message']}")
+    typer.echo(f"Deleted {deleted} objects under {bucket_name}/{prefix}")
+    if errors:
+        raise typer.Exit(1)
+
+
 @app.command()
 def get_bucket_versioning_cmd(bucket_name: str):
     client = init_client()
@@ -153,10 +354,19 @@ def get_bucket_versioning_cmd(bucket_name: str):
     typer.echo(f"Versioning for bucket {bucket_name}: {'Enabled' if is_enabled else 'Disabled'}")
 
 
+def version_index(cached, refresh):
+    if refresh:
+        return VersionIndex(full_max_age=0)
+    return VersionIndex() if cached else None
+
+
 @app.command()
-def list_file_versions_cmd(bucket_name: str, file_name: str):
+def list_file_versions_cmd(bucket_name: str, file_name: str,
+                           cached: bool = typer.Option(False, "--cached", help="Use the local version index"),
+                           refresh: bool = typer.Option(False, "--refresh",
+                                                        help="Re-list every version into the index")):
     client = init_client()
-    versions = list_file_versions(client, bucket_name, file_name)
+    versions = list_file_versions(client, bucket_name, file_name, version_index(cached, refresh))
     if versions:
         typer.echo(f"\nVersions of {file_name} in {bucket_name}:")
         for version in versions:
@@ -179,15 +389,53 @@ def restore_version_cmd(bucket_name: str, file_name: str, version_id: str):
         typer.echo("Failed to restore version")
 
 
+@app.command()
+def restore_prefix_cmd(bucket_name: str, prefix: str,
+                       as_of: str = typer.Option(..., help="ISO 8601 time to restore to, UTC unless an offset is given"),
+                       workers: int = typer.Option(16, help="Parallel copies"),
+                       dry_run: bool = typer.Option(False, "--dry-run", help="Only print what would change")):
+    """
+    Restore every key under a prefix to the version current at a point in time
+    """
+    try:
+        timestamp = parse_timestamp(as_of)
+    except ValueError as e:
+        typer.echo(f"Error: {e}")
+        raise typer.Exit(1)
+
+    client = init_client(workers + 1)
+    try:
+        summary = restore_prefix(client, bucket_name, prefix, timestamp, workers, dry_run)
+    except ClientError as e:
+        typer.echo(f"Error listing versions: {e}")
+        raise typer.Exit(1)
+
+    for error in summary['failed']:
+        typer.echo(f"Failed to restore {error['Key']}: {error['Message']}")
+    if dry_run:
+        typer.echo(f"Would restore {summary['restored']} objects and delete {summary['deleted']}, "
+                   f"{summary['unchanged']} unchanged")
+    else:
+        typer.echo(f"Restored {summary['restored']} objects, deleted {summary['deleted']}, "
+                   f"{summary['unchanged']} unchanged")
+    if summary['failed']:
+        raise typer.Exit(1)
+
+
 @app.command()
 def collecting_objects_cmd(bucket_name: str,
-                           collect: bool = typer.Option(False, "--col", help="Flag to confirm collection")):
+                           collect: bool = typer.Option(False, "--col", help="Flag to confirm collection"),
+                           workers: int = typer.Option(16, help="Parallel copies"),
+                           journal: Optional[str] = typer.Option(None, help="Journal file used to resume"),
+                           from_index: bool = typer.Option(False, "--from-index",
+                                                           help="Take the object list from index-bucket-cmd")):
     if not collect:
         typer.echo("Please provide --col flag to confirm collection")
         raise typer.Exit(1)
 
-    client = init_client()
-    result = collecting_objects(bucket_name, client)
+    client = init_client(workers + 1)
+    result = collecting_objects(bucket_name, client, max_workers=workers, journal_path=journal,
+                                index=BucketIndex() if from_index else None)
 
     if result:
         typer.echo(f"Successfully collected objects from {bucket_name}")
@@ -196,6 +444,108 @@ def collecting_objects_cmd(bucket_name: str,
         raise typer.Exit(1)
 
 
+@app.command()
+def list_objects_cmd(bucket_name: str, prefix: str = "",
+                     parallel: bool = typer.Option(False, "--parallel", help="List common prefixes concurrently"),
+                     workers: int = typer.Option(8, help="Listing threads in parallel mode")):
+    """
+    Stream every object under a prefix as NDJSON
+    """
+    client = init_client(workers)
+    try:
+        for obj in iter_objects(client, bucket_name, prefix, parallel=parallel, max_workers=workers):
+            typer.echo(json.dumps({
+                'Key': obj['Key'],
+                'Size': obj['Size'],
+                'ETag': obj['ETag'].strip('"'),
+                'LastModified': obj['LastModified'].isoformat(),
+                'StorageClass': obj.get('StorageClass', 'STANDARD')
+            }))
+    except ClientError as e:
+        typer.echo(f"Error listing objects: {e}", err=True)
+        raise typer.Exit(1)
+
+
+@app.command()
+def index_bucket_cmd(bucket_name: str, prefix: str = ""):
+    """
+    Build or refresh the local SQLite inventory of a bucket (or one prefix)
+    """
+    client = init_client(8)
+    try:
+        objects, changed, removed = BucketIndex().refresh(client, bucket_name, prefix)
+    except ClientError as e:
+        typer.echo(f"Error listing objects: {e}")
+        raise typer.Exit(1)
+    typer.echo(f"Indexed {objects} objects: {changed} new or changed, {removed} removed")
+
+
+@app.command()
+def query_index_cmd(bucket_name: str, prefix: str = "",
+                    ext_counts: bool = typer.Option(False, "--ext-counts", help="Object count per extension"),
+                    size_by_prefix: bool = typer.Option(False, "--size-by-prefix",
+                                                        help="Size per next-level prefix"),
+                    largest: int = typer.Option(0, help="Show the N largest objects"),
+                    older_than: Optional[int] = typer.Option(None, help="Objects older than N days"),
+                    keys_only: bool = typer.Option(False, "--keys-only", help="Print only keys, one per line")):
+    """
+    Answer inventory questions from the index built by index-bucket-cmd
+    """
+    if largest and older_than is not None:
+        # Both print key lists; mixed together they could not be told apart or piped
+        typer.echo("Error: use either --largest or --older-than")
+        raise typer.Exit(1)
+    index = BucketIndex()
+    if ext_counts:
+        for ext, count, size in index.extension_counts(bucket_name, prefix):
+            typer.echo(f"{ext or '(none)'}: {count} files, {size / (1024 * 1024):.1f} MB")
+    if size_by_prefix:
+        for sub_prefix, count, size in index.size_by_prefix(bucket_name, prefix):
+            typer.echo(f"{sub_prefix}: {count} files, {size / (1024 * 1024):.1f} MB")
+    rows = []
+    if largest:
+        rows = index.largest(bucket_name, largest, prefix)
+    elif older_than is not None:
+        rows = index.older_than(bucket_name, older_than, prefix)
+    for key, size, last_modified in rows:
+        typer.echo(key if keys_only else f"{key}\t{size}\t{last_modified}")
+
+
+@app.command()
+def deploy_site_cmd(site_dir: str, bucket_name: str, prefix: str = "",
+                    prune: bool = typer.Option(True, "--prune/--no-prune",
+                                               help="Delete remote files that are gone locally"),
+                    compress: bool = typer.Option(False, "--compress", help="Gzip text-like files"),
+                    workers: int = typer.Option(32, help="Parallel uploads"),
+                    configure: bool = typer.Option(False, "--configure",
+                                                   help="Create the bucket and enable website hosting")):
+    """
+    Publish a static site directory, uploading only changed files
+    """
+    if not os.path.isdir(site_dir):
+        typer.echo(f"Error: {site_dir} is not a directory")
+        raise typer.Exit(1)
+
+    client = init_client(workers)
+    if configure:
+        if not create_bucket(client, bucket_name):
+            typer.echo("Failed to create bucket")
+            raise typer.Exit(1)
+        try:
+            configure_website(client, bucket_name)
+        except ClientError as e:
+            typer.echo(f"Error configuring website: {e}")
+            raise typer.Exit(1)
+
+    summary = deploy_site(client, bucket_name, site_dir, prefix, prune, compress, workers)
+    if summary is False:
+        raise typer.Exit(1)
+    typer.echo(f"Uploaded {summary['uploaded']}, unchanged {summary['unchanged']}, "
+               f"deleted {summary['deleted']}, failed {summary['failed']}")
+    if summary['failed']:
+        raise typer.Exit(1)
+
+
 @app.command()
 def upload_to_folder_cmd(
         bucket_name: str,
@@ -212,13 +562,17 @@ def upload_to_folder_cmd(
 
 
 @app.command()
-def delete_old_files_cmd(bucket_name: str, file_name: str):
+def delete_old_files_cmd(bucket_name: str, file_name: str,
+                         cached: bool = typer.Option(False, "--cached", help="Use the local version index"),
+                         refresh: bool = typer.Option(False, "--refresh",
+                                                      help="Re-list every version into the index")):
     client = init_client()
-    delete_old_files(bucket_name, client, file_name)
+    delete_old_files(bucket_name, client, file_name, version_index(cached, refresh))
 
 
 @app.command()
-def create_static_website_cmd(bucket_name: str, file_name: str):
+def create_static_website_cmd(bucket_name: str, file_name: str,
+                              compress: bool = typer.Option(False, "--compress", help="Serve the page gzipped")):
     client = init_client()
 
     if not create_bucket(client, bucket_name):
@@ -226,22 +580,9 @@ def create_static_website_cmd(bucket_name: str, file_name: str):
         raise typer.Exit(1)
 
     try:
-        client.delete_public_access_block(
-            Bucket=bucket_name
-        )
+        configure_website(client, bucket_name)
 
-        website_configuration = {
-            'ErrorDocument': {'Key': 'error.html'},
-            'IndexDocument': {'Suffix': 'index.html'},
-        }
-        client.put_bucket_website(Bucket=bucket_name, WebsiteConfiguration=website_configuration)
-
-        client.put_bucket_policy(
-            Bucket=bucket_name,
-            Policy=generate_public_read_policy(bucket_name)
-        )
-
-        if upload_small_file(client, bucket_name, file_name):
+        if upload_small_file(client, bucket_name, file_name, compress=compress):
             typer.echo(f"Successfully configured static website hosting for {bucket_name}")
             typer.echo(f"Website URL: http://{bucket_name}.s3-website-{client.meta.region_name}.amazonaws.com")
         else:
@@ -253,7 +594,8 @@ def create_static_website_cmd(bucket_name: str, file_name: str):
 
 
 @app.command()
-def create_webpage_from_url_cmd(bucket_name: str, source_url: str):
+def create_webpage_from_url_cmd(bucket_name: str, source_url: str,
+                                compress: bool = typer.Option(False, "--compress", help="Serve the page gzipped")):
     """
     Creates a static website from a URL source
 
@@ -273,41 +615,9 @@ def create_webpage_from_url_cmd(bucket_name: str, source_url: str):
             typer.echo("Failed to create bucket")
             raise typer.Exit(1)
 
-        website_configuration = {
-            'ErrorDocument': {'Key': 'error.html'},
-            'IndexDocument': {'Suffix': 'index.html'},
-        }
-
-        client.delete_public_access_block(Bucket=bucket_name)
-
-        client.put_bucket_website(
-            Bucket=bucket_name,
-            WebsiteConfiguration=website_configuration
-        )
-
-        client.put_bucket_policy(
-            Bucket=bucket_name,
-            Policy=generate_public_read_policy(bucket_name)
-        )
-
-        if basic_file_upload(bucket_name, tmp_file, client):
-            client.copy_object(
-                Bucket=bucket_name,
-                CopySource={'Bucket': bucket_name, 'Key': os.path.basename(tmp_file)},
-                Key='index.html',
-            )
-            client.delete_object(
-                Bucket=bucket_name,
-                Key=os.path.basename(tmp_file)
-            )
-            with open(tmp_file, 'rb') as file:
-                client.put_object(
-                    Bucket=bucket_name,
-                    Key='index.html',
-                    Body=file,
-                    ContentType='text/html'
-                )
+        configure_website(client, bucket_name)
 
+        if upload_small_file(client, bucket_name, tmp_file, 'index.html', 'text/html', compress):
             typer.echo(f"Successfully created website from {source_url}")
             typer.echo(f"Website URL: http://{bucket_name}.s3-website-{client.meta.region_name}.amazonaws.com")
         else:
@@ -329,6 +639,8 @@ def inspire_cmd(
     """
     Get inspiring quotes from the API. Optionally filter by author and save to S3.
     """
+    import requests
+
     try:
         quote_url = f"https://api.quotable.kurokeita.dev/api/quotes/random?author={author}"
         quote_response = requests.get(quote_url)
@@ -374,5 +686,93 @@ def inspire_cmd(
         raise typer.Exit(1)
 
 
+def run_cli(argv):
+    """
+    Run one command line in this process and return its exit code
+    """
+    try:
+        typer.main.get_command(app).main(args=argv, prog_name="main.py")
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        typer.echo(e.code, err=True)
+        return 1
+    except Exception as e:
+        typer.echo(f"Error: {e}", err=True)
+        return 1
+    return 0
+
+
+def parse_batch_line(line):
+    """
+    A batch line is either a command line or a JSON op
+    {"command": "list-buckets-cmd", "args": [...]}
+    """
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    if line.startswith("{"):
+        op = json.loads(line)
+        return [op["command"], *[str(arg) for arg in op.get("args", [])]]
+    return shlex.split(line)
+
+
+@app.command()
+def batch_cmd(file: str = typer.Argument("-", help="File with one command per line, - for stdin"),
+              stop_on_error: bool = typer.Option(False, "--stop-on-error", help="Stop at the first failure")):
+    """
+    Run many commands in one process, sharing a warm client and its connections
+    """
+    global _batch_depth
+
+    source = sys.stdin if file == "-" else open(file)
+    failed = 0
+    _batch_depth += 1
+    try:
+        with source:
+            for line_number, line in enumerate(source, 1):
+                try:
+                    argv = parse_batch_line(line)
+                except (ValueError, KeyError) as e:
+                    typer.echo(f"Line {line_number}: invalid command: {e}", err=True)
+                    argv, exit_code = None, 1
+                else:
+                    if argv is None:
+                        continue
+                    if argv[0] in ("batch-cmd", "serve-cmd"):
+                        typer.echo(f"Line {line_number}: {argv[0]} cannot be nested", err=True)
+                        exit_code = 1
+                    else:
+                        exit_code = run_cli(argv)
+                if exit_code:
+                    failed += 1
+                    if stop_on_error:
+                        break
+    finally:
+        _batch_depth -= 1
+    if failed:
+        typer.echo(f"{failed} commands failed", err=True)
+        raise typer.Exit(1)
+
+
+@app.command()
+def serve_cmd(socket_path: str = typer.Option(..., "--socket", help="Unix socket to listen on")):
+    """
+    Keep a warm process on a Unix socket; set aws_s3_cli_socket to the same
+    path and plain invocations of main.py run their command here
+    """
+    from app.daemon import serve
+
+    init_client()
+    typer.echo(f"Listening on {socket_path}")
+    def run(argv):
+        if argv[:1] in (["batch-cmd"], ["serve-cmd"]):
+            typer.echo(f"{argv[0]} cannot run in the daemon", err=True)
+            return 1
+        return run_cli(argv)
+
+    serve(socket_path, run)
+
+
 if __name__ == "__main__":
     app()